@@ -0,0 +1 @@
+"""Offline benchmarks for crash analysis, see `python -m benchmarks --help`."""
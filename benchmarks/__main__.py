@@ -0,0 +1,220 @@
+"""Benchmarks for crash analysis. Run from the repo root with `python -m benchmarks --help`."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Optional
+
+# fred refuses to import without these, but nothing here connects to anything
+for _var in ("FRED_IP", "FRED_PORT", "FRED_TOKEN", "FRED_SQL_DB", "FRED_SQL_USER", "FRED_SQL_PASSWORD"):
+    os.environ.setdefault(_var, "unused")
+os.environ.setdefault("FRED_SQL_HOST", "localhost")
+os.environ.setdefault("FRED_SQL_PORT", "5432")
+os.environ.setdefault("FRED_LOG_LEVEL", "WARNING")
+
+from fred import config  # noqa: E402
+from fred.cogs.crashes import Crashes, InstallInfo  # noqa: E402
+from fred.libraries import crash_rules  # noqa: E402
+
+from . import corpus  # noqa: E402
+from .harness import Result, compare, run_case  # noqa: E402
+from .stubs import StubBot, StubSMR  # noqa: E402
+
+# there's no DB to read the settings from, so they start out empty (every version is 0) and stay that way
+config._settings = config.MiscSettings()
+
+MB = 1024 * 1024
+
+
+class Suite:
+    def __init__(self, args: argparse.Namespace, cog: Crashes, smr: StubSMR):
+        self.args = args
+        self.cog = cog
+        self.smr = smr
+        self.results: list[Result] = []
+        self.errors: dict[str, str] = {}  # case name -> what it raised
+        self._rule_count: Optional[int] = None
+
+    def wanted(self, name: str) -> bool:
+        return not self.args.filter or any(part in name for part in self.args.filter)
+
+    def runs(self, default: int) -> int:
+        return max(1, default // 4) if self.args.quick else default
+
+    def use_rules(self, count: int):
+        if self._rule_count != count:
+            rules = corpus.crash_rules(count, self.args.seed)
+            prefix, version = self.cog.bot.command_prefix, config.Crashes.version()
+            crash_rules.rule_cache.replace(prefix, version, crash_rules.compile_rules(version, prefix, rules, set()))
+            self._rule_count = count
+
+    async def case(self, name: str, case, **kwargs):
+        if not self.wanted(name):
+            return
+        try:
+            result = await run_case(name, case, **kwargs)
+        except Exception as e:
+            # one broken case shouldn't cost us the rest of the run
+            self.errors[name] = f"{type(e).__name__}: {e}"
+            print(f"{name:<40} failed: {self.errors[name]}", flush=True)
+            return
+        self.results.append(result)
+        print(result.line(), flush=True)
+
+    async def file_case(self, name: str, filename: str, content: bytes, runs: int):
+        file = io.BytesIO(content)
+
+        def setup():
+            file.seek(0)
+            # we want the analysis, not the caches
+            self.cog.analysis_cache.clear()
+            self.cog.mod_cache.clear()
+
+        await self.case(
+            name, lambda: self.cog.process_file(filename, file), runs=runs, input_bytes=len(content), setup=setup
+        )
+
+    async def chat(self):
+        self.use_rules(500)
+        messages = corpus.chat_messages(200, self.args.seed)
+        size = sum(len(message.encode()) for message in messages)
+
+        async def process_all():
+            for message in messages:
+                await self.cog.process_text(message)
+
+        await self.case("chat/200 messages", process_all, runs=self.runs(8), input_bytes=size)
+
+    async def rule_sets(self):
+        text = corpus.log_text(MB, self.args.seed).decode()
+        for count in (50, 500) if self.args.quick else (50, 500, 2000):
+            self.use_rules(count)
+            await self.case(
+                f"rules/{count} on 1 MB", lambda: self.cog.process_text(text), runs=self.runs(20), input_bytes=MB
+            )
+
+    async def logs(self):
+        self.use_rules(500)
+        for size, runs in ((1, 20), (10, 8), (100, 3)):
+            if self.args.quick and size == 100:
+                continue
+            name = f"logs/{size} MB"
+            if self.wanted(name):
+                content = corpus.log_text(size * MB, self.args.seed)
+                await self.file_case(name, "FactoryGame.log", content, self.runs(runs))
+
+    async def zips(self):
+        self.use_rules(500)
+        for mods in (50, 250, 1000):
+            name = f"zips/{mods} mods"
+            if self.wanted(name):
+                content = corpus.debug_zip(mods, seed=self.args.seed)
+                await self.file_case(name, "SMMDebug.zip", content, self.runs(10))
+
+    async def install_info(self):
+        for mods in (50, 1000):
+            metadata = corpus.metadata_json(mods)
+            await self.case(
+                f"install_info/metadata {mods} mods",
+                lambda: _run_sync(InstallInfo.from_metadata_json, io.BytesIO(metadata), "metadata.json"),
+                runs=self.runs(50),
+                input_bytes=len(metadata),
+            )
+
+        info = InstallInfo.from_metadata_json(io.BytesIO(corpus.metadata_json(50)), "metadata.json")
+        for size in (1, 10):
+            log = corpus.log_text(size * MB, self.args.seed)
+            await self.case(
+                f"install_info/fg log {size} MB",
+                lambda: _run_sync(info.update_from_fg_log, io.BytesIO(log)),
+                runs=self.runs(10),
+                input_bytes=len(log),
+            )
+
+    async def check_mods(self):
+        for mods in (50, 1000):
+            installed = corpus.mod_references(mods)
+            await self.case(
+                f"check_mods/{mods} mods",
+                lambda: self.cog.check_mods(installed),
+                runs=self.runs(20),
+                setup=self.cog.mod_cache.clear,
+            )
+            await self.case(
+                f"check_mods/{mods} mods, cached", lambda: self.cog.check_mods(installed), runs=self.runs(20)
+            )
+
+    async def run(self):
+        await self.chat()
+        await self.rule_sets()
+        await self.logs()
+        await self.zips()
+        await self.install_info()
+        await self.check_mods()
+
+
+async def _run_sync(func, *args):
+    return func(*args)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main(args: argparse.Namespace) -> tuple[list[Result], dict[str, str]]:
+    smr = StubSMR(args.smr_latency / 1000)
+    bot = StubBot(smr)
+    cog = Crashes(bot)
+    try:
+        suite = Suite(args, cog, smr)
+        await suite.run()
+        print(f"\n{smr.queries} stub SMR queries made")
+        return suite.results, suite.errors
+    finally:
+        cog.cog_unload()
+        bot.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--quick", action="store_true", help="fewer runs, and skip the biggest inputs")
+    parser.add_argument("--filter", nargs="*", default=[], help="only run cases whose name contains one of these")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated corpus")
+    parser.add_argument("--smr-latency", type=float, default=0, help="milliseconds the stub SMR waits per query")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to save the results")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    arguments = parser.parse_args()
+
+    results, errors = asyncio.run(main(arguments))
+
+    with open(arguments.output, "w") as output:
+        report = {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "args": vars(arguments),
+            "results": [result.as_dict() for result in results],
+            "errors": errors,
+        }
+        json.dump(report, output, indent=2)
+    print(f"Saved results to {arguments.output}")
+
+    if arguments.compare:
+        with open(arguments.compare) as previous:
+            print(f"\nCompared to {arguments.compare}:")
+            print("\n".join(compare(json.load(previous), results)))
+
+    if errors:
+        raise SystemExit(f"\n{len(errors)} case(s) failed: {', '.join(errors)}")
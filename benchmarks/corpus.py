@@ -0,0 +1,131 @@
+"""Generates the inputs the benchmarks run on. Everything is derived from a seed, so runs are comparable."""
+
+from __future__ import annotations
+
+import io
+import json
+import random
+import zipfile
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fred import config
+
+SML_VERSION = "3.11.3"
+GAME_CL = 416835
+
+_CATEGORIES = ["LogStreaming", "LogNet", "LogTemp", "LogRHI", "LogAudio", "LogGame", "LogWorld", "LogPakFile"]
+_WORDS = "asset loaded texture mesh actor spawn buffer shader level package module failed warning request".split()
+
+_LOG_HEADER = (
+    "[2024.06.01-12.00.00:000][  0]LogInit: Net CL: {cl}\n"
+    "[2024.06.01-12.00.00:000][  0]LogInit: Command Line: -EpicPortal -epicusername=someone -AUTH_PASSWORD=hunter2\n"
+    "[2024.06.01-12.00.00:000][  0]LogInit: Base Directory: C:/Program Files/Epic Games/SatisfactoryEarlyAccess/\n"
+    "[2024.06.01-12.00.00:000][  0]LogInit: Launcher ID: Epic\n"
+    "[2024.06.01-12.00.01:000][  0]LogSatisfactoryModLoader: Display: "
+    "Satisfactory Mod Loader v.{sml} pre-initializing\n"
+)
+
+_LOG_CRASH = (
+    "[2024.06.01-12.30.00:000][999]LogWindows: Error: Fatal error: [File:D:/build/Engine/Source/Runtime/Core/Private/"
+    "Misc/AssertionMacros.cpp] [Line: 123] Assertion failed: Module{n} != nullptr\n"
+    "[2024.06.01-12.30.00:000][999]LogWindows: Critical error: === Critical error: === Unhandled Exception: "
+    "EXCEPTION_ACCESS_VIOLATION reading address 0x0000000000000000 (Engine exit requested (reason: crash))\n"
+)
+
+
+def _log_block(rng: random.Random, lines: int) -> str:
+    block = []
+    for i in range(lines):
+        category = rng.choice(_CATEGORIES)
+        words = " ".join(rng.choices(_WORDS, k=rng.randint(4, 14)))
+        timestamp = f"2024.06.01-12.{i // 600 % 60:02}.{i // 10 % 60:02}:{i % 1000:03}"
+        block.append(f"[{timestamp}][{i % 1000:3}]{category}: {words}")
+    return "\n".join(block) + "\n"
+
+
+def log_text(size: int, seed: int = 0) -> bytes:
+    """A FactoryGame.log of roughly `size` bytes, with the details the analysis looks for and a crash at the end."""
+    rng = random.Random(seed)
+    block = _log_block(rng, 2000).encode()
+    out = io.BytesIO()
+    out.write(_LOG_HEADER.format(cl=GAME_CL, sml=SML_VERSION).encode())
+    while out.tell() < size:
+        out.write(block[: size - out.tell()])
+        out.write(b"\n")
+    out.write(_LOG_CRASH.format(n=rng.randint(0, 49)).encode())
+    return out.getvalue()
+
+
+def chat_messages(count: int, seed: int = 0) -> list[str]:
+    """Short messages like the ones people send while asking for help, some of which trip a rule."""
+    rng = random.Random(seed)
+    templates = [
+        "my game crashes when i load my save, any ideas?",
+        "I updated and now nothing loads lol",
+        "got Assertion failed: Module{n} != nullptr after installing a mod",
+        "how do I install SML {sml}",
+        "it says Mod mod_{n} v1.{n}.0 failed to load, what do",
+        "thanks fred",
+    ]
+    return [rng.choice(templates).format(n=rng.randint(0, 49), sml=SML_VERSION) for _ in range(count)]
+
+
+def mod_references(count: int) -> dict[str, str]:
+    return {f"Mod{i:04}": f"1.{i % 7}.{i % 3}" for i in range(count)}
+
+
+def metadata_json(mods: int) -> bytes:
+    installation = {
+        "version": str(GAME_CL),
+        "type": "WindowsClient",
+        "path": "C:/Program Files/Epic Games/SatisfactoryEarlyAccess",
+        "launcher": "Epic",
+        "launchPath": "-EpicPortal -epicusername=someone",
+    }
+    metadata = {
+        "installations": [installation],
+        "selectedInstallation": installation,
+        "profiles": ["default"],
+        "selectedProfile": "default",
+        "installedMods": mod_references(mods),
+        "smlVersion": SML_VERSION,
+        "smmVersion": "3.0.3",
+        "modsEnabled": True,
+    }
+    return json.dumps(metadata).encode()
+
+
+def debug_zip(mods: int, log_size: int = 1024 * 1024, seed: int = 0) -> bytes:
+    """A zip shaped like the ones SMM's "generate debug info" produces."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("metadata.json", metadata_json(mods))
+        archive.writestr("FactoryGame.log", log_text(log_size, seed))
+        archive.writestr("pre-launch-debug.log", log_text(log_size // 8, seed + 1))
+    return out.getvalue()
+
+
+_RULE_SHAPES = [
+    r"Assertion failed: Module{n} != nullptr",
+    r"Mod mod_{n} v(\d+\.\d+)\.\d+ failed to load",
+    r"LogSatisfactoryModLoader: Error: .*Widget{n}\b",
+    r"Fatal error: \[File:[^\]]*Thing{n}\.cpp\]",
+    r"Couldn't find file for package /Game/FactoryGame/Mod{n}/.*",
+    r"(?<!Not )an Exception{n} occurred",  # needs the fallback engine
+    r"Unhandled Exception: EXCEPTION_{n}_VIOLATION",
+    r"LogStreaming: Error: Couldn't find .* Asset{n}",
+]
+
+
+def crash_rules(count: int, seed: int = 0) -> list[config.CrashesDict]:
+    """Crash rules shaped like the real ones: mostly literal text, some wildcards, groups and lookarounds."""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        shape = _RULE_SHAPES[i % len(_RULE_SHAPES)]
+        number = i // len(_RULE_SHAPES) if rng.random() < 0.9 else rng.randint(1000, 9999)
+        has_group = "(" in shape.replace("(?", "")
+        response = "You're using an old version of {1}, update it!" if has_group else "Known issue."
+        rules.append(dict(name=f"rule{i:04}", crash=shape.format(n=number), response=response))
+    return rules
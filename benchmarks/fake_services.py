@@ -0,0 +1,237 @@
+"""Local stand-ins for every HTTP service the bot talks to: SMR's GraphQL API, the Discord CDN, pastebin, ficsit.app's
+images and the Algolia docs index. Each can be given latency and a rate of injected errors, so the bot can be load
+tested against them. Run with `python -m benchmarks.fake_services --help`, then start the bot with the environment it
+prints."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import random
+from functools import lru_cache
+
+from aiohttp import web
+
+from . import corpus
+from .stubs import StubSMR
+
+SERVICES = ("smr", "cdn", "pastebin", "ficsit", "algolia")
+
+_DOC_PAGES = [
+    ("Getting started", "Development/BeginnersGuide/index.html"),
+    ("Setting up the project", "Development/BeginnersGuide/project_setup.html"),
+    ("Installing mods", "ForUsers/SatisfactoryModManager.html"),
+    ("Crash logs", "faq.html#_where_are_my_log_files"),
+    ("Blueprint hooking", "Development/ModLoader/BlueprintHooks.html"),
+    ("Configuration", "Development/ModLoader/Configuration.html"),
+    ("Dedicated servers", "ForUsers/DedicatedServerSetup.html"),
+    ("Updating your mod", "Development/UpdatingToNewVersions.html"),
+]
+
+
+class Behaviour:
+    """How badly a fake service behaves: a fixed delay plus up to `jitter` more, and how often it fails."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+class FakeServices:
+    def __init__(self, behaviours: dict[str, Behaviour], seed: int = 0, mod_count: int = 5000):
+        self.behaviours = behaviours
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.base_url = ""  # known once we're listening
+        self.smr = StubSMR(mod_count=mod_count)
+        self.requests = {service: 0 for service in SERVICES}
+        self.errors = {service: 0 for service in SERVICES}
+
+    def environment(self) -> dict[str, str]:
+        """What to set for the bot to use these instead of the real services."""
+        overrides = {
+            "https://cdn.discordapp.com": f"{self.base_url}/cdn",
+            "https://media.discordapp.net": f"{self.base_url}/cdn",
+            "https://pastebin.com": f"{self.base_url}/pastebin",
+            "https://ficsit.app": f"{self.base_url}/ficsit",
+        }
+        return {
+            "FRED_SMR_API_URL": f"{self.base_url}/smr/v2/query",
+            "FRED_ALGOLIA_URL": self.base_url,  # the Algolia client only takes a host, so it gets the root
+            "FRED_URL_OVERRIDES": ",".join(f"{prefix}={replacement}" for prefix, replacement in overrides.items()),
+        }
+
+    @staticmethod
+    def _service(request: web.Request) -> str:
+        first = request.path.strip("/").split("/")[0]
+        return "algolia" if first == "1" else first
+
+    @web.middleware
+    async def misbehave(self, request: web.Request, handler):
+        if (service := self._service(request)) not in self.behaviours:
+            return await handler(request)
+        behaviour = self.behaviours[service]
+        self.requests[service] += 1
+        if delay := behaviour.latency + self.rng.uniform(0, behaviour.jitter):
+            await asyncio.sleep(delay)
+        if self.rng.random() < behaviour.error_rate:
+            self.errors[service] += 1
+            raise web.HTTPServiceUnavailable(text=f"injected {service} error")
+        return await handler(request)
+
+    async def smr_query(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response(await self.smr.query(body["query"]))
+
+    @staticmethod
+    def _conditional(request: web.Request, data: bytes, content_type: str) -> web.Response:
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=data, content_type=content_type, headers={"ETag": etag})
+
+    async def cdn_file(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        size = int(request.query.get("size", 256 * 1024))
+        return self._conditional(request, _cdn_file(name, size, self.seed), "application/octet-stream")
+
+    async def pastebin_raw(self, request: web.Request) -> web.Response:
+        paste = request.match_info["paste"]
+        seed = int(hashlib.sha1(paste.encode()).hexdigest(), 16) % 1000
+        return web.Response(text=corpus.log_text(64 * 1024, seed).decode(), content_type="text/plain")
+
+    async def ficsit_image(self, request: web.Request) -> web.Response:
+        return self._conditional(request, _logo(request.match_info["path"]), "image/webp")
+
+    async def algolia_query(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        query = body.get("query", "")
+        words = query.lower().split()
+        pages = [page for page in _DOC_PAGES if any(word in page[0].lower() for word in words)]
+        hits = [
+            {
+                "objectID": str(index),
+                "url": f"https://docs.ficsit.app/satisfactory-modding/latest/{path}",
+                "hierarchy": {"lvl0": "Satisfactory Modding latest", "lvl1": title},
+            }
+            for index, (title, path) in enumerate(pages)
+        ]
+        return web.json_response(
+            {
+                "hits": hits,
+                "nbHits": len(hits),
+                "nbPages": 1,
+                "page": 0,
+                "hitsPerPage": 20,
+                "processingTimeMS": 1,
+                "exhaustiveNbHits": True,
+                "query": query,
+                "params": f"query={query}",
+            }
+        )
+
+    async def stats(self, _: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "errors": self.errors, "smr_queries": self.smr.queries})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.misbehave], client_max_size=16 * 1024 * 1024)
+        app.add_routes(
+            [
+                web.post("/smr/v2/query", self.smr_query),
+                web.get("/cdn/attachments/{path:.*/}{name}", self.cdn_file),
+                web.get("/pastebin/raw/{paste}", self.pastebin_raw),
+                web.get("/ficsit/{path:.*}", self.ficsit_image),
+                web.post("/1/indexes/{index}/query", self.algolia_query),
+                web.get("/_stats", self.stats),
+            ]
+        )
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        self.base_url = f"http://{host}:{port}"
+        self.smr.logo_url = f"{self.base_url}/ficsit/images"
+        return runner
+
+
+@lru_cache(maxsize=64)
+def _cdn_file(name: str, size: int, seed: int) -> bytes:
+    """What someone might have uploaded under `name`: a log, a debug zip, or just some bytes."""
+    if name.endswith((".log", ".txt")):
+        return corpus.log_text(size, seed)
+    if name.endswith(".zip"):
+        return corpus.debug_zip(mods=50, log_size=size, seed=seed)
+    return random.Random(f"{name}{seed}").randbytes(size)
+
+
+@lru_cache(maxsize=256)
+def _logo(path: str) -> bytes:
+    from PIL import Image  # only needed for this, and not by the benchmarks
+
+    colour = tuple(hashlib.sha1(path.encode()).digest()[:3])
+    with io.BytesIO() as buffer:
+        Image.new("RGB", (256, 256), colour).save(buffer, "webp")
+        return buffer.getvalue()
+
+
+def _per_service(values: list[str], name: str) -> dict[str, float]:
+    """Parses repeated `service=value` options, where `all` sets every service not set on its own."""
+    parsed: dict[str, float] = {}
+    for value in values:
+        service, _, number = value.rpartition("=")
+        service = service or "all"
+        if service != "all" and service not in SERVICES:
+            raise SystemExit(f"Unknown service {service!r} for --{name}, expected one of {', '.join(SERVICES)}")
+        parsed[service] = float(number)
+    return {service: parsed.get(service, parsed.get("all", 0.0)) for service in SERVICES}
+
+
+async def main(args: argparse.Namespace):
+    latency = _per_service(args.latency, "latency")
+    jitter = _per_service(args.jitter, "jitter")
+    error_rate = _per_service(args.error_rate, "error-rate")
+    behaviours = {
+        service: Behaviour(latency[service] / 1000, jitter[service] / 1000, error_rate[service]) for service in SERVICES
+    }
+    services = FakeServices(behaviours, seed=args.seed, mod_count=args.mods)
+    runner = await services.start(args.host, args.port)
+    print(f"Fake services listening on {services.base_url}, request counts at {services.base_url}/_stats")
+    print("Start the bot with:")
+    for variable, value in services.environment().items():
+        print(f"  {variable}={json.dumps(value)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.fake_services", description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0, help="seed for the canned data and injected errors")
+    parser.add_argument("--mods", type=int, default=5000, help="how many mods the fake SMR has")
+    parser.add_argument(
+        "--latency", action="append", default=[], metavar="[SERVICE=]MS", help="delay per request, e.g. smr=200"
+    )
+    parser.add_argument(
+        "--jitter", action="append", default=[], metavar="[SERVICE=]MS", help="up to this much extra random delay"
+    )
+    parser.add_argument(
+        "--error-rate",
+        action="append",
+        default=[],
+        metavar="[SERVICE=]RATE",
+        help="fraction of requests answered with a 503, e.g. cdn=0.05",
+    )
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
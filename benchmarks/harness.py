@@ -0,0 +1,146 @@
+"""Runs benchmark cases and collects latency, throughput and memory numbers for them."""
+
+from __future__ import annotations
+
+import gc
+import multiprocessing
+import resource
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from attr import dataclass, asdict
+
+
+def _reset_peak_rss(pid: int | str = "self") -> bool:
+    # Linux lets us reset the high water mark, so each case gets its own peak rather than the process's
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _read_peak_rss_mb(pid: int | str = "self") -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb() -> float:
+    if (peak := _read_peak_rss_mb()) is not None:
+        return peak
+    # ru_maxrss is in KiB on Linux and bytes on macOS, but either way it never resets
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_pids() -> list[int]:
+    # the regex and OCR pools' workers, which is where the heavy lifting (and memory use) of an analysis happens
+    return [child.pid for child in multiprocessing.active_children() if child.pid is not None]
+
+
+def _workers_peak_rss_mb(pids: list[int]) -> Optional[float]:
+    """The sum of each worker's peak, so an upper bound on what they used at once. Workers that were killed during the
+    case are missing, since their memory can't be read any more."""
+    peaks = [peak for pid in pids if (peak := _read_peak_rss_mb(pid)) is not None]
+    return sum(peaks) if peaks or not pids else None
+
+
+def _quantile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+@dataclass
+class Result:
+    name: str
+    runs: int
+    p50_ms: float
+    p99_ms: float
+    mean_ms: float
+    ops_per_s: float
+    mb_per_s: Optional[float]  # only for cases that work through a known amount of input
+    peak_rss_mb: float  # of this process only, see workers_peak_rss_mb for the worker processes
+    peak_rss_is_per_case: bool
+    workers_peak_rss_mb: Optional[float]  # None if the workers' memory can't be read, i.e. not on Linux
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    def line(self) -> str:
+        throughput = f"{self.mb_per_s:8.1f} MB/s" if self.mb_per_s is not None else f"{self.ops_per_s:8.1f} op/s"
+        workers = f" + workers {self.workers_peak_rss_mb:7.1f} MB" if self.workers_peak_rss_mb is not None else ""
+        return (
+            f"{self.name:<40} {self.runs:>4} runs  p50 {self.p50_ms:9.2f} ms  p99 {self.p99_ms:9.2f} ms  "
+            f"{throughput}  peak {self.peak_rss_mb:7.1f} MB{workers}"
+        )
+
+
+async def run_case(
+    name: str,
+    case: Callable[[], Awaitable[Any]],
+    *,
+    runs: int,
+    warmup: int = 1,
+    input_bytes: Optional[int] = None,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Result:
+    """Times `runs` calls of `case` after `warmup` untimed ones. `setup` runs untimed before every call."""
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        await case()
+
+    gc.collect()
+    per_case = _reset_peak_rss()
+    # workers started during the case are new, so their peak is the case's anyway
+    for pid in _worker_pids():
+        _reset_peak_rss(pid)
+    samples = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await case()
+        samples.append(time.perf_counter() - start)
+
+    mean = statistics.fmean(samples)
+    return Result(
+        name=name,
+        runs=runs,
+        p50_ms=_quantile(samples, 0.5) * 1000,
+        p99_ms=_quantile(samples, 0.99) * 1000,
+        mean_ms=mean * 1000,
+        ops_per_s=1 / mean if mean else 0.0,
+        mb_per_s=input_bytes / mean / 1024 / 1024 if input_bytes is not None and mean else None,
+        peak_rss_mb=_peak_rss_mb(),
+        peak_rss_is_per_case=per_case,
+        workers_peak_rss_mb=_workers_peak_rss_mb(_worker_pids()),
+    )
+
+
+def compare(old: dict[str, Any], new: list[Result]) -> list[str]:
+    """Lines describing how each case changed since an earlier run's JSON."""
+    previous = {result["name"]: result for result in old.get("results", [])}
+    lines = []
+    for result in new:
+        if (before := previous.get(result.name)) is None:
+            lines.append(f"{result.name:<40} new")
+            continue
+        change = (result.p50_ms - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+        rss_change = result.peak_rss_mb - before["peak_rss_mb"]
+        workers = ""
+        # older results don't have the workers' memory
+        if result.workers_peak_rss_mb is not None and (workers_before := before.get("workers_peak_rss_mb")) is not None:
+            workers = f", workers {result.workers_peak_rss_mb - workers_before:+.1f} MB"
+        lines.append(
+            f"{result.name:<40} p50 {before['p50_ms']:9.2f} -> {result.p50_ms:9.2f} ms ({change:+.1%})  "
+            f"peak {rss_change:+.1f} MB{workers}"
+        )
+    return lines
@@ -0,0 +1,99 @@
+"""Stand-ins for the bot, Discord and SMR, so the analysis can run without a network or a database."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# the analysis sends aliased fields, several to a request
+_MODS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?getMods\(filter: {references: (\[.*?\]).*?compatibility {\s*(\w+)", re.S)
+_SML_VERSIONS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?getSMLVersions")
+# the mirror's paging, the mod command's search and the mod picker's lookup by ID
+_MODS_PAGE = re.compile(r"getMods\(filter: {limit: (\d+), offset: (\d+)")
+_MODS_SEARCH = re.compile(r'getMods\(filter: { search: "(.*?)"')
+_MOD_BY_ID = re.compile(r'getModByIdOrReference\(modIdOrReference: "(.*?)"')
+
+
+class StubSMR:
+    """Answers the mod lookup queries the way SMR would, after an optional delay to stand in for the network."""
+
+    def __init__(self, latency: float = 0.0, mod_count: int = 5000, logo_url: str = "https://ficsit.app/images"):
+        self.latency = latency
+        self.mod_count = mod_count  # how many mods there are to page through or search
+        self.logo_url = logo_url
+        self.queries = 0
+
+    def _mod(self, reference: str, branch: str) -> dict:
+        number = int(reference.removeprefix("Mod") or 0)
+        return {
+            "name": f"Mod number {number}",
+            "mod_reference": reference,
+            "versions": [{"version": f"1.{number % 7}.{number % 3 + (number % 5 == 0)}"}],
+            "compatibility": {branch: {"state": "Broken" if number % 97 == 0 else "Works", "note": "It's broken"}},
+        }
+
+    def _full_mod(self, number: int) -> dict:
+        """Every field anything asks SMR for about a mod."""
+        mod = self._mod(f"Mod{number}", "EA")
+        mod["compatibility"]["EXP"] = mod["compatibility"]["EA"]
+        return mod | {
+            "id": f"id{number}",
+            "authors": [{"user": {"username": f"Modder{number % 50}"}}],
+            "logo": f"{self.logo_url}/Mod{number}/logo.webp",
+            "short_description": f"Does thing number {number}",
+            "last_version_date": "2024-09-10T12:00:00Z",
+            "updated_at": f"2024-09-{10 + number % 20:02d}T12:{number % 60:02d}:00+00:00",
+        }
+
+    async def query(self, query: str) -> dict:
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        data = {}
+        for field in _SML_VERSIONS_FIELD.finditer(query):
+            versions = [
+                {"version": f"3.{minor}.0", "satisfactory_version": 400000 + minor * 2000} for minor in range(11, 0, -1)
+            ]
+            data[field.group(1) or "getSMLVersions"] = {"sml_versions": versions}
+
+        for field in _MODS_FIELD.finditer(query):
+            alias, references, branch = field.groups()
+            data[alias or "getMods"] = {"mods": [self._mod(reference, branch) for reference in json.loads(references)]}
+
+        if match := _MODS_PAGE.search(query):
+            limit, offset = map(int, match.groups())
+            page = [self._full_mod(number) for number in range(offset, min(offset + limit, self.mod_count))]
+            data["getMods"] = {"count": self.mod_count, "mods": page}
+        elif match := _MODS_SEARCH.search(query):
+            search = match.group(1).lower()
+            numbers = [number for number in range(self.mod_count) if search in f"mod number {number}"][:100]
+            data["getMods"] = {"mods": [self._full_mod(number) for number in numbers]}
+        if match := _MOD_BY_ID.search(query):
+            number = int(match.group(1).removeprefix("id").removeprefix("Mod") or 0)
+            data["getModByIdOrReference"] = self._full_mod(number) if number < self.mod_count else None
+
+        return {"data": data}
+
+
+class StubBot:
+    """Just enough of `fred.Bot` for the crash analysis cog."""
+
+    def __init__(self, smr: StubSMR):
+        self.smr = smr
+        self.command_prefix = ">"
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor()
+        self.web_session = None  # nothing in the corpus should make the analysis fetch anything
+        self.SMRMirror = None  # so check_mods goes through the stub SMR
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()  # never "ready", so the cog's background loops stay idle
+
+    async def repository_query(self, query: str) -> dict:
+        return await self.smr.query(query)
+
+    def close(self):
+        self.executor.shutdown()
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import codecs
+import hashlib
 import io
 import json
 import os
 import re as regex_fallback
 from asyncio import Task, TaskGroup
+from os import getenv
 from os.path import split
 from pathlib import Path
 from typing import (
@@ -15,51 +18,113 @@ from typing import (
     Coroutine,
     Generator,
     Optional,
+    Sequence,
     Any,
     Final,
-    TypedDict,
     AsyncGenerator,
 )
 from urllib.parse import urlparse
-from zipfile import ZipFile
 
 import re2
 
 re2.set_fallback_notification(re2.FALLBACK_WARNING)
 re2.set_fallback_module(regex_fallback)
 
-from aiohttp import ClientResponseError
+from aiohttp import ClientError
 from attr import dataclass
-from nextcord import Message, HTTPException, Forbidden, NotFound, File
-from semver import Version
+from nextcord import Attachment, Message, HTTPException, File
 
 from .. import config
-from ..libraries import createembed, ocr
-from ..libraries.common import FredCog, new_logger
+from ..libraries import createembed, crash_rules, ocr
+from ..libraries.archive import ExtractedArchive, extract_archive
+from ..libraries.cache import RefreshingValue, TTLCache
+from ..libraries.circuit_breaker import CircuitOpenError
+from ..libraries.command_table import command_table
+from ..libraries.common import FredCog, new_logger, redirect_url
 from ..libraries.createembed import CrashResponse
+from ..libraries.metrics import metrics
+from ..libraries.smr import ModInfo, SMLVersions, parse_version
+from ..libraries.regex_util import (
+    PREFILTER,
+    MatchResult,
+    RuleSet,
+    RuleTimeoutError,
+    regex_pool,
+    safe_search,
+    safe_search_all,
+)
 
-from ..libraries.regex_util import safe_search
-
-REGEX_LIMIT: float = 6.9
 DOWNLOAD_SIZE_LIMIT = 104857600  # 100 MiB
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_CONCURRENCY = 4  # per message
 EMOJI_CRASHES_ANALYZING = "<:FredAnalyzingFile:1283182945019891712>"
 EMOJI_CRASHES_TIMEOUT = "<:FredAnalyzingTimedOut:1283183010967195730>"
+# logs bigger than this are scanned in chunks rather than decoded and searched in one go
+STREAM_THRESHOLD = int(getenv("FRED_LOG_STREAM_THRESHOLD", 16 * 1024 * 1024))
+LOG_CHUNK_SIZE = int(getenv("FRED_LOG_CHUNK_SIZE", 1024 * 1024))
+# how much of the previous chunk is searched again, so matches spanning two chunks are still found
+LOG_CHUNK_OVERLAP = int(getenv("FRED_LOG_CHUNK_OVERLAP", 64 * 1024))
+# how much of the end of a streamed log is kept for rules that need the whole file, and for finding the crash
+WHOLE_FILE_WINDOW = int(getenv("FRED_LOG_WHOLE_FILE_WINDOW", 4 * 1024 * 1024))
+ANALYSIS_CACHE_SIZE = 256
+ANALYSIS_CACHE_TTL = 3600  # seconds, also bounds how stale the mod update checks can get
+# SML releases only come out a few times a year
+SML_VERSIONS_TTL = int(getenv("FRED_SML_VERSIONS_TTL", 6 * 3600))
+SML_VERSIONS_MAX_STALE = 7 * 24 * 3600
+MOD_QUERY_CHUNK_SIZE = 100  # SMR won't return more mods than this per query
+MOD_QUERY_CONCURRENCY = 4  # requests in flight, across everything being analysed
+MOD_CACHE_SIZE = 10000
+MOD_CACHE_TTL = int(getenv("FRED_MOD_CACHE_TTL", 300))  # short, people upload logs right after a mod is fixed
+
+# how long crash analysis waits on SMR before giving up on the mod checks and answering with what it has
+MOD_CHECK_BUDGET = float(getenv("FRED_MOD_CHECK_BUDGET", 10))
+
+MOD_CHECKS_SKIPPED = "Mod checks skipped"
+
+_NOT_CACHED = object()
 
 logger = new_logger(__name__)
 
 
-async def regex_with_timeout(*args, **kwargs):
-    try:
-        return await asyncio.wait_for(asyncio.to_thread(re2.search, *args, **kwargs), REGEX_LIMIT)
-    except asyncio.TimeoutError:
-        raise TimeoutError(
-            f"A regex timed out after {REGEX_LIMIT} seconds! \n"
-            f"pattern: ({args[0]}) \n"
-            f"flags: {kwargs['flags']} \n"
-            f"on text of length {len(args[1])}"
-        )
-    except re2.RegexError as e:
-        raise ValueError(args[0]) from e
+@dataclass(frozen=True)
+class CachedAnalysis:
+    """The responses for one file, with any attached files kept as raw contents so they can be sent again."""
+
+    responses: tuple[tuple[CrashResponse, Optional[tuple[str, str | bytes]]], ...]
+
+    @classmethod
+    def freeze(cls, responses: list[CrashResponse]) -> Optional[CachedAnalysis]:
+        frozen = []
+        for response in responses:
+            if isinstance(att := response.attachment, File):
+                if not hasattr(att.fp, "getvalue"):
+                    return None  # we can't copy it without consuming it, so don't cache this one
+                frozen.append((response, (att.filename, att.fp.getvalue())))
+            else:
+                frozen.append((response, None))
+        return cls(tuple(frozen))
+
+    def thaw(self) -> list[CrashResponse]:
+        responses = []
+        for response, attached in self.responses:
+            if attached is not None:
+                filename, content = attached
+                fp = io.StringIO(content) if isinstance(content, str) else io.BytesIO(content)
+                response = CrashResponse(
+                    name=response.name,
+                    value=response.value,
+                    attachment=File(fp, filename=filename, force_close=True),
+                    inline=response.inline,
+                )
+            responses.append(response)
+        return responses
+
+
+def _content_digest(file: IO[bytes]) -> str:
+    position = file.tell()
+    digest = hashlib.file_digest(file, "sha256").hexdigest()
+    file.seek(position)
+    return digest
 
 
 class Crashes(FredCog):
@@ -67,34 +132,52 @@ class Crashes(FredCog):
     type CrashJob = Coroutine[Any, Any, list[CrashResponse]]
     type CrashJobGenerator = Generator[Crashes.CrashJob, None, None]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # key: (sha256 of the file, its name, crash rules version, commands version). The name is in there because the
+        # responses quote it, and which jobs run depends on its extension. Crash rules can respond with commands, hence
+        # their version
+        self.analysis_cache: TTLCache[tuple[str, str, int, int], CachedAnalysis] = TTLCache(
+            ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL
+        )
+        # key: (mod reference, game branch), value: None if SMR doesn't have the mod
+        self.mod_cache: TTLCache[tuple[str, str], Optional[ModInfo]] = TTLCache(MOD_CACHE_SIZE, MOD_CACHE_TTL)
+        self._smr_limit = asyncio.Semaphore(MOD_QUERY_CONCURRENCY)
+        self.sml_versions: RefreshingValue[SMLVersions] = RefreshingValue(
+            "SML versions", self._fetch_sml_versions, SML_VERSIONS_TTL, SML_VERSIONS_MAX_STALE
+        )
+
+    def cog_unload(self):
+        regex_pool.shutdown()
+        ocr.ocr_pool.shutdown()
+
+    async def _fetch_sml_versions(self) -> SMLVersions:
+        with metrics.timed("graphql"):
+            result = await self.bot.repository_query("{" + self._SML_VERSIONS_FIELD % "getSMLVersions" + "}")
+        return SMLVersions(result["data"]["getSMLVersions"]["sml_versions"])
+
     async def make_sml_version_message(self, game_version: int = 0, sml: str = "", **_) -> Optional[CrashResponse]:
         if game_version and sml:
             # Check the right SML for that CL
-            query = """{
-              getSMLVersions {
-                sml_versions {
-                  version
-                  satisfactory_version
-                }
-              }
-            }"""
-            result = await self.bot.repository_query(query)
-            sml_versions = result["data"]["getSMLVersions"]["sml_versions"]
-            is_compatible = lambda s: s["satisfactory_version"] <= game_version
-            latest_compatible_sml = next(filter(is_compatible, sml_versions))
+            if (mirror := self.bot.SMRMirror) is not None and mirror.sml_versions is not None:
+                sml_versions = mirror.sml_versions
+            else:
+                sml_versions = await self.sml_versions.get()
+            if (latest_compatible_sml := sml_versions.latest_compatible(int(game_version))) is None:
+                return None  # older than anything SML supports, nothing useful to suggest
             if (new_version := latest_compatible_sml["version"]) != sml:
                 msg: str = (
                     "You are not using the most recent SML release for your game. " f"Please update to {new_version}."
                 )
-                if latest_compatible_sml != sml_versions[0]:
+                if latest_compatible_sml != sml_versions.latest:
                     msg += "\nAlso, your game itself may need an update!"
                 return CrashResponse("Outdated SML!", msg, inline=True)
         return None
 
+    # Fields for one combined query, each under an alias so several can go in the same request
     # fmt: off
-    _QUERY_TEMPLATE: Final[str] = """
-    {
-      getMods(filter: {references: %s, limit: 100}) {
+    _MODS_FIELD: Final[str] = """
+      %s: getMods(filter: {references: %s, limit: 100}) {
         mods {
           name
           mod_reference
@@ -109,16 +192,38 @@ class Crashes(FredCog):
           }
         }
       }
-    }
+    """
+    _SML_VERSIONS_FIELD: Final[str] = """
+      %s: getSMLVersions {
+        sml_versions {
+          version
+          satisfactory_version
+        }
+      }
     """
     # fmt: on
 
-    class _ModLookupGQLResponse(TypedDict):
-        id: str
-        name: str
-        mod_reference: str
-        versions: list[dict[str, str]]
-        compatibility: dict[str, dict[str, str]]
+    async def _query_mods(
+        self, chunks: list[list[str]], branch: str, with_sml_versions: bool = False
+    ) -> tuple[list[list[ModInfo]], Optional[SMLVersions]]:
+        """Looks up every chunk of mods, and optionally the SML versions, in a single request."""
+        fields = [self._MODS_FIELD % (f"mods{i}", json.dumps(chunk), branch) for i, chunk in enumerate(chunks)]
+        if with_sml_versions:
+            fields.append(self._SML_VERSIONS_FIELD % "smlVersions")
+        async with self._smr_limit:
+            with metrics.timed("graphql"):
+                result = await self.bot.repository_query("{" + "".join(fields) + "}")
+
+        # this guarantees this won't annoyingly KeyError and will only add nothing
+        data = result.get("data") or {}
+        mods = [
+            [ModInfo.from_query(mod) for mod in (data.get(f"mods{i}") or {}).get("mods", [])]
+            for i in range(len(chunks))
+        ]
+        sml_versions = None
+        if with_sml_versions and (sml := data.get("smlVersions")):
+            sml_versions = SMLVersions(sml["sml_versions"])
+        return mods, sml_versions
 
     async def check_mods(
         self, input_mods: InstallInfo.InstalledMods, experimental: bool = False
@@ -127,45 +232,60 @@ class Crashes(FredCog):
         if not input_mods:
             return responses
 
+        game_branch = "EXP" if experimental else "EA"
+        known: dict[str, Optional[ModInfo]] = {}
+        missing: list[str] = []
+        mirror = self.bot.SMRMirror
+        for reference in input_mods:
+            if mirror is not None and mirror.ready:
+                # mods the mirror doesn't have aren't on SMR (or weren't a sync ago), so we can't check them anyway
+                known[reference] = mirror.mod_info(reference, game_branch)
+            elif (cached := self.mod_cache.get((reference, game_branch), _NOT_CACHED)) is not _NOT_CACHED:
+                known[reference] = cached
+            else:
+                missing.append(reference)
+
         # This separates the mods into blocks of 100 because of API restrictions
-        def formatted_chunks_of_100_mod_references() -> Generator[str, None, None]:
-            mods = input_mods.copy()
-            while mods:
-                new_chunk = []
-                while mods and len(new_chunk) < 100:
-                    new_chunk.append(mods.popitem()[0])
-                yield json.dumps(new_chunk)
-
-        queried_mods: list[Crashes._ModLookupGQLResponse] = []
-        for chunk in formatted_chunks_of_100_mod_references():
-            # formats the list appropriately for GQL
-            game_branch = "EXP" if experimental else "EA"
-            query = self._QUERY_TEMPLATE % (chunk, game_branch)
-
-            queried_mods.extend(
-                # this guarantees this won't annoyingly KeyError and will only add nothing
-                (await self.bot.repository_query(query))
-                .get("data", {})
-                .get("getMods", {})
-                .get("mods", [])
+        chunks = [missing[i : i + MOD_QUERY_CHUNK_SIZE] for i in range(0, len(missing), MOD_QUERY_CHUNK_SIZE)]
+        results: list[list[ModInfo]] = []
+        try:
+            if chunks:
+                # the SML versions come along for the ride if they're due a refresh, saving a request later
+                with_sml_versions = self.sml_versions.needs_refresh and (mirror is None or not mirror.ready)
+                async with asyncio.timeout(MOD_CHECK_BUDGET):
+                    results, sml_versions = await self._query_mods(chunks, game_branch, with_sml_versions)
+                if sml_versions is not None:
+                    self.sml_versions.set(sml_versions)
+        except (CircuitOpenError, ClientError, TimeoutError) as e:
+            # the rest of the analysis is still worth sending, so carry on with only the mods we already knew
+            self.logger.warning(f"Skipping the SMR lookup of {len(missing)} mods: {e!r}")
+            responses.append(
+                CrashResponse(
+                    MOD_CHECKS_SKIPPED,
+                    f"I couldn't reach SMR in time, so {len(missing)} of your mods weren't checked "
+                    "for updates or known issues.",
+                )
             )
 
+        for chunk, mods in zip(chunks, results):
+            found = {mod.mod_reference: mod for mod in mods}
+            for reference in chunk:
+                # mods SMR doesn't know about are remembered too, so we don't keep asking
+                known[reference] = found.get(reference)
+                self.mod_cache.set((reference, game_branch), known[reference])
+
         broken_mods: list[tuple[str, str]] = []
         outdated_mods: list[tuple[str, str]] = []
-        for mod in queried_mods:
-            mod_name = mod["name"]
-            mod_compat = mod["compatibility"]
-            if mod_compat is None:
+        for reference, mod in known.items():
+            if mod is None or mod.compatibility is None:
                 continue  # we have no way of knowing
-            compat_info = mod_compat.get("EA") or mod_compat.get("EXP")
-            mod_latest_version = Version.parse(mod["versions"][0]["version"])
-            using_mod_version = Version.parse(input_mods[mod["mod_reference"]])
+            using_mod_version = parse_version(input_mods[reference])
 
-            if compat_info["state"] == "Broken":
-                broken_mods.append((mod_name, compat_info["note"]))
+            if mod.compatibility["state"] == "Broken":
+                broken_mods.append((mod.name, mod.compatibility["note"]))
 
-            if mod_latest_version > using_mod_version and not mod_latest_version.prerelease:
-                outdated_mods.append((mod_name, str(mod_latest_version)))
+            if mod.latest_version > using_mod_version and not mod.latest_version.prerelease:
+                outdated_mods.append((mod.name, str(mod.latest_version)))
 
         if broken_mods:
             string = "\n".join(f"{mod[0]}: {mod[1]}" for mod in broken_mods)
@@ -186,40 +306,53 @@ class Crashes(FredCog):
             responses.append(CrashResponse("Outdated mods found!", string))
         return responses
 
-    async def mass_regex(self, text: str) -> AsyncIterator[CrashResponse]:
-        for crash in config.Crashes.fetch_all():
-            if match := await safe_search(crash["crash"], text, flags=re2.IGNORECASE | re2.S):
-                if str(crash["response"]).startswith(self.bot.command_prefix):
-                    if command := config.Commands.fetch(crash["response"].strip(self.bot.command_prefix)):
-                        command_response = command["content"]
-                        if command_response.startswith(self.bot.command_prefix):  # is alias
-                            command = config.Commands.fetch(command_response.strip(self.bot.command_prefix))
-                        yield CrashResponse(
-                            name=crash["name"],
-                            value=command["content"],
-                            attachment=command["attachment"],
-                            inline=True,
-                        )
-                else:
-
-                    def replace_response_value_with_captured(m) -> str:
-                        group = int(m.group(1))
-                        if group > len(match.groups()):
-                            return f"{{Group {group} not captured in crash regex!}}"
-                        return match.group(group)
+    @staticmethod
+    async def _search_rules(
+        rules: crash_rules.CompiledCrashRules, rule_set: RuleSet, indices: Sequence[int], text: str
+    ) -> list[tuple[int, MatchResult]]:
+        """Searches with one of the rule sets, recording how long each rule took and whether it hit.
+        `indices` maps the set's rules to `rules.crashes`, and the results use the latter."""
+        timings: dict[int, float] = {}
+        try:
+            with metrics.timed("regex"):
+                hits = await safe_search_all(rule_set, text, timings)
+        except RuleTimeoutError as e:
+            # only a rule that went over its own limit is to blame, a slow combined pass isn't any one rule's fault
+            if e.rule_index is not None:
+                metrics.record_rule_timeout(rules.crashes[indices[e.rule_index]].name)
+            else:
+                metrics.count("rule_set_timeouts")
+            raise
+
+        if (prefilter := timings.pop(PREFILTER, None)) is not None:
+            metrics.stages["regex_prefilter"].observe(prefilter)
+        matched = {index for index, _ in hits}
+        for index, seconds in timings.items():
+            metrics.record_rule(rules.crashes[indices[index]].name, seconds, index in matched)
+        return [(indices[index], match) for index, match in hits]
+
+    async def _respond(
+        self, rules: crash_rules.CompiledCrashRules, hits: Sequence[tuple[int, MatchResult]]
+    ) -> list[CrashResponse]:
+        """The responses of the rules that hit, looking up the commands some of them respond with."""
+        commands = None
+        if any(rules.crashes[index].command is not None for index, _ in hits):
+            commands = await command_table.get(self.bot.command_prefix)
+        return [
+            response for index, match in hits if (response := rules.crashes[index].respond(match, commands)) is not None
+        ]
 
-                    response = re2.sub(
-                        r"{(\d+)}",
-                        replace_response_value_with_captured,
-                        str(crash["response"]),
-                    )
-                    yield CrashResponse(name=crash["name"], value=response, inline=True)
+    async def mass_regex(self, text: str) -> AsyncIterator[CrashResponse]:
+        rules = await crash_rules.rule_cache.get(self.bot.command_prefix)
+        hits = await self._search_rules(rules, rules.rule_set, range(len(rules.crashes)), text)
+        for response in await self._respond(rules, hits):
+            yield response
 
     async def detect_and_fetch_pastebin_content(self, text: str) -> str:
         if match := await safe_search(r"(https://pastebin.com/\S+)", text):
             self.logger.info("Found a pastebin link! Fetching text.")
             url = re2.sub(r"(?<=bin.com)/", "/raw/", match.group(1))
-            async with self.bot.web_session.get(url) as response:
+            async with self.bot.web_session.get(redirect_url(url)) as response:
                 return await response.text()
         else:
             return ""
@@ -232,7 +365,11 @@ class Crashes(FredCog):
         responses = [msg async for msg in self.mass_regex(text)]
 
         responses.extend(await self.process_text(await self.detect_and_fetch_pastebin_content(text)))
+        responses.extend(await self.find_crash(text, filename))
 
+        return responses
+
+    async def find_crash(self, text: str, filename: str) -> list[CrashResponse]:
         if match := await safe_search(
             r"([^\n]*Critical error:.*Engine exit[^\n]*\))",
             text,
@@ -240,7 +377,7 @@ class Crashes(FredCog):
         ):
             filename = os.path.basename(filename)
             crash = match.group(1)
-            responses.append(
+            return [
                 CrashResponse(
                     name=f"Crash found in {filename}",
                     value="It has been attached to this message.",
@@ -250,51 +387,149 @@ class Crashes(FredCog):
                         force_close=True,
                     ),
                 )
-            )
-
+            ]
+        return []
+
+    async def process_log_stream(self, file: IO[bytes], filename: str) -> list[CrashResponse]:
+        """Scans a log that is too big to decode in one go, in chunks that overlap so that matches spanning
+        two chunks are still found. Rules that need the whole file only see the end of the log instead,
+        which is where the interesting part of a crash is."""
+        self.logger.info(f"Scanning {filename} in chunks")
+        rules = await crash_rules.rule_cache.get(self.bot.command_prefix)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        hits: dict[int, MatchResult] = {}
+        pastebin_text = ""
+        window = ""
+        tail = ""
+
+        async def scan(chunk: str):
+            nonlocal window, tail, pastebin_text
+            if not chunk:
+                return
+            window = window[-LOG_CHUNK_OVERLAP:] + chunk
+            tail = (tail + chunk)[-WHOLE_FILE_WINDOW:]
+            for index, match in await self._search_rules(rules, rules.chunked_rule_set, rules.chunked_indices, window):
+                hits.setdefault(index, match)
+            if not pastebin_text:
+                pastebin_text = await self.detect_and_fetch_pastebin_content(window)
+
+        while data := await asyncio.to_thread(file.read, LOG_CHUNK_SIZE):
+            await scan(decoder.decode(data))
+        await scan(decoder.decode(b"", final=True))
+
+        for index, match in await self._search_rules(rules, rules.whole_file_rule_set, rules.whole_file_indices, tail):
+            hits.setdefault(index, match)
+
+        responses = await self._respond(rules, sorted(hits.items()))
+        responses.extend(await self.process_text(pastebin_text))
+        responses.extend(await self.find_crash(tail, filename))
         return responses
 
     async def process_image(self, file: IO) -> list[CrashResponse]:
-        return await self.process_text(await self.bot.loop.run_in_executor(self.bot.executor, ocr.read, file))
+        return await self.process_text(await ocr.read_async(file))
 
-    def _create_debug_messages(self, debug_zip: ZipFile, filename: str) -> Optional[CrashJob]:
-        files = debug_zip.namelist()
+    @staticmethod
+    def _read_install_info(archive: ExtractedArchive) -> Optional[InstallInfo]:
         info: Optional[InstallInfo] = None
-        if "metadata.json" in files:
-            with debug_zip.open("metadata.json") as f:
-                info = InstallInfo.from_metadata_json(f, filename)
+        if metadata := archive.member("metadata.json"):
+            info = InstallInfo.from_metadata_json(metadata.file, archive.path)
+            metadata.file.seek(0)
 
         if info is None:
             return None
 
-        if "FactoryGame.log" in files:
-            with debug_zip.open("FactoryGame.log") as f:
-                info.update_from_fg_log(f)
+        if log := archive.member("FactoryGame.log"):
+            info.update_from_fg_log(log.file)
+            log.file.seek(0)
+
+        return info
+
+    def _get_archive_jobs(self, archive: ExtractedArchive) -> CrashJobGenerator:
+        for member in archive.members:
+            yield from self._get_file_jobs(member.path, member.file)
+        for nested in archive.archives:
+            yield self.process_archive(nested)
+
+    async def process_archive(self, archive: ExtractedArchive) -> list[CrashResponse]:
+        # this has to finish before the other jobs start, as they read the same files
+        info = await asyncio.to_thread(self._read_install_info, archive)
+
+        jobs = [asyncio.ensure_future(job) for job in self._get_archive_jobs(archive)]
+        if info is not None:
+            jobs.insert(0, asyncio.ensure_future(self.check_mods(info.installed_mods)))
 
-        async def coro_rtn():
-            return [info.format(), *await self.check_mods(info.installed_mods)]
+        try:
+            results = await asyncio.gather(*jobs)
+        except BaseException:
+            for job in jobs:
+                job.cancel()
+            raise
+
+        responses = [info.format()] if info is not None else []
+        responses.extend(response for result in results for response in result)
+        return responses
+
+    async def process_zip(self, file: IO[bytes], filename: str) -> list[CrashResponse]:
+        with metrics.timed("unzip"):
+            archive = await asyncio.to_thread(
+                extract_archive, file, filename, lambda name: self._ext_filter(self._file_extension(name))
+            )
+        try:
+            responses = await self.process_archive(archive)
+        finally:
+            archive.close()
 
-        return coro_rtn()
+        if problems := archive.all_problems():
+            responses.append(
+                CrashResponse(
+                    name=f"Parts of {filename} were skipped",
+                    value="\n".join(problems[:10]) + ("\n..." if len(problems) > 10 else ""),
+                )
+            )
+        return responses
 
     def _get_file_jobs(self, filename: str, file: IO) -> CrashJobGenerator:
         match self._file_extension(filename):
             case "zip":
-                self.logger.info(f"Adding jobs from zip file {filename}")
-                zip_file = ZipFile(file)
-                if res := self._create_debug_messages(zip_file, filename):
-                    yield res
-                for zipped_item_filename in zip_file.namelist():
-                    with zip_file.open(zipped_item_filename) as zip_item:
-                        yield from self._get_file_jobs(f"{filename}/{zipped_item_filename}", zip_item)
+                self.logger.info(f"Adding job for zip file {filename}")
+                yield self.process_zip(file, filename)
             case "log" | "txt" | "json":
                 self.logger.info(f"Adding job for log/text file {filename}")
-                yield self.process_text(str(file.read().decode()), filename=filename)
+                size = file.seek(0, io.SEEK_END)
+                file.seek(0)
+                if size <= STREAM_THRESHOLD:
+                    yield self.process_text(str(file.read().decode()), filename=filename)
+                else:
+                    yield self.process_log_stream(file, filename)
             case "png":
                 self.logger.info(f"Adding job for png file {filename}")
                 yield self.process_image(file)
             case _:
                 self.logger.info(f"Not adding any job for {filename}")
 
+    async def process_file(self, filename: str, file: IO[bytes]) -> list[CrashResponse]:
+        """Runs every job for a file, or reuses the results from the last time we saw the same file."""
+        rules = await crash_rules.rule_cache.get(self.bot.command_prefix)
+        key = (await asyncio.to_thread(_content_digest, file), filename, rules.version, config.Commands.version())
+        if (cached := self.analysis_cache.get(key)) is not None:
+            self.logger.info(f"Reusing the analysis of an identical file for {filename}")
+            return cached.thaw()
+
+        jobs = [asyncio.ensure_future(job) for job in self._get_file_jobs(filename, file)]
+        try:
+            results = await asyncio.gather(*jobs)
+        except BaseException:
+            for job in jobs:
+                job.cancel()
+            raise
+
+        responses = [response for result in results for response in result]
+        if any(response.name == MOD_CHECKS_SKIPPED for response in responses):
+            return responses  # don't keep an incomplete analysis around, SMR may be back next time
+        if (frozen := CachedAnalysis.freeze(responses)) is not None:
+            self.analysis_cache.set(key, frozen)
+        return responses
+
     @staticmethod
     def _file_extension(filename: str) -> str:
         return filename.rpartition(".")[-1].lower()
@@ -303,6 +538,29 @@ class Crashes(FredCog):
     def _ext_filter(ext: str) -> bool:
         return ext in ("png", "log", "txt", "zip", "json")
 
+    async def _download_linked_file(self, url: str) -> IO[bytes]:
+        async with self.bot.web_session.get(redirect_url(url)) as response:
+            response.raise_for_status()
+            if int(response.headers.get("Content-Length", 0)) > DOWNLOAD_SIZE_LIMIT:
+                raise ResourceWarning("File unreasonably large!")
+
+            # the header can be missing or wrong, so we also stop once we've actually read too much
+            buffer = io.BytesIO()
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > DOWNLOAD_SIZE_LIMIT:
+                    buffer.close()
+                    raise ResourceWarning("File unreasonably large!")
+
+        buffer.seek(0)
+        return buffer
+
+    async def _download_discord_attachment(self, att: Attachment) -> IO[bytes]:
+        if att.size > DOWNLOAD_SIZE_LIMIT:
+            raise ResourceWarning("File unreasonably large!")
+        file = await att.to_file()
+        return file.fp
+
     async def _obtain_attachments(self, message: Message) -> AsyncGenerator[tuple[str, IO | Exception], None, None]:
         cdn_links = re2.findall(
             r"(https://(?:cdn.discordapp.com|media.discordapp.net)/attachments/\S+)",
@@ -311,35 +569,42 @@ class Crashes(FredCog):
 
         yield bool(cdn_links or message.attachments)
 
+        downloads: list[tuple[str, Coroutine[Any, Any, IO[bytes]]]] = []
         for att_url in cdn_links:
-            self.logger.info("Attempting to acquire linked file manually")
-            url_path = urlparse(att_url).path
-            _, name = split(url_path)
-
+            _, name = split(urlparse(att_url).path)
             if self._ext_filter(self._file_extension(name)):
-                try:
-
-                    async with self.bot.web_session.head(att_url) as response:
-                        response.raise_for_status()
-                        if int(response.headers.get("Content-Length", 0)) > DOWNLOAD_SIZE_LIMIT:
-                            yield name, ResourceWarning(f"File unreasonably large!")
-
-                    async with self.bot.web_session.get(att_url) as response:
-                        response.raise_for_status()
-                        yield name, io.BytesIO(await response.read())
-
-                except ClientResponseError as e:
-                    yield name, e
+                self.logger.info("Attempting to acquire linked file manually")
+                downloads.append((name, self._download_linked_file(att_url)))
 
         for att in message.attachments:
-            self.logger.info("Attempting to acquire file via Discord")
-            name = att.filename
-            if self._ext_filter(self._file_extension(name)):
-                try:
-                    file = await att.to_file()
-                    yield name, file.fp
-                except HTTPException | Forbidden | NotFound as e:
-                    yield name, e
+            if self._ext_filter(self._file_extension(att.filename)):
+                self.logger.info("Attempting to acquire file via Discord")
+                downloads.append((att.filename, self._download_discord_attachment(att)))
+
+        limit = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+        async def download(name: str, coro: Coroutine[Any, Any, IO[bytes]]) -> tuple[str, IO | Exception]:
+            try:
+                async with limit:
+                    with metrics.timed("download"):
+                        return name, await coro
+            except (ClientError, ResourceWarning, HTTPException) as e:
+                return name, e
+            except TimeoutError:
+                # from the session's timeouts. It mustn't get any further, process_message would take it for the
+                # analysis timing out
+                return name, TimeoutError("the download took too long")
+            finally:
+                coro.close()  # in case we got cancelled before it started
+
+        tasks = [asyncio.create_task(download(name, coro)) for name, coro in downloads]
+        try:
+            # hand each file over as soon as it arrives, so its jobs can start while the rest download
+            for next_download in asyncio.as_completed(tasks):
+                yield await next_download
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def process_message(self, message: Message) -> bool:
         """
@@ -379,7 +644,7 @@ class Crashes(FredCog):
 
                     file: IO = file_or_exc
                     files.append(file)
-                    jobs.extend((task_group.create_task(job) for job in self._get_file_jobs(name, file)))
+                    jobs.append(task_group.create_task(self.process_file(name, file)))
         except ExceptionGroup as eg:
             for ex in eg.exceptions:
                 if isinstance(ex, TimeoutError):
@@ -406,37 +671,40 @@ class Crashes(FredCog):
             await message.remove_reaction(EMOJI_CRASHES_ANALYZING, self.bot.user)
 
         if filtered_responses := list(set(responses)):  # remove dupes
-
-            resp_files = [
-                await self.bot.obtain_attachment(att) if isinstance(att, str) else att
-                for resp in filtered_responses
-                if (att := resp.attachment) is not None
-            ]
-
-            if len(filtered_responses) == 1:
-                self.logger.info("Found only one response to message, sending.")
-                await self.bot.reply_to_msg(
-                    message,
-                    f"{filtered_responses[0].value}\n-# Responding to `{filtered_responses[0].name}` triggered by {message.author.mention}",
-                    propagate_reply=False,
-                    files=resp_files,
-                )
-
-            else:
-
-                self.logger.info("Found responses to message, sending.")
-                embed = createembed.crashes(filtered_responses)
-                embed.set_author(
-                    name=f"Automated responses for {message.author.global_name or message.author.display_name} ({message.author.id})",
-                    icon_url=message.author.display_avatar.url,
-                )
-                await self.bot.reply_to_msg(message, embed=embed, propagate_reply=False, files=resp_files)
+            with metrics.timed("send"):
+                await self._send_responses(message, filtered_responses)
             return True
 
         else:
             self.logger.info("No responses to message, skipping.")
             return False
 
+    async def _send_responses(self, message: Message, filtered_responses: list[CrashResponse]):
+        resp_files = [
+            await self.bot.obtain_attachment(att) if isinstance(att, str) else att
+            for resp in filtered_responses
+            if (att := resp.attachment) is not None
+        ]
+
+        if len(filtered_responses) == 1:
+            self.logger.info("Found only one response to message, sending.")
+            await self.bot.reply_to_msg(
+                message,
+                f"{filtered_responses[0].value}\n-# Responding to `{filtered_responses[0].name}` triggered by {message.author.mention}",
+                propagate_reply=False,
+                files=resp_files,
+            )
+
+        else:
+
+            self.logger.info("Found responses to message, sending.")
+            embed = createembed.crashes(filtered_responses)
+            embed.set_author(
+                name=f"Automated responses for {message.author.global_name or message.author.display_name} ({message.author.id})",
+                icon_url=message.author.display_avatar.url,
+            )
+            await self.bot.reply_to_msg(message, embed=embed, propagate_reply=False, files=resp_files)
+
 
 def filter_epic_commandline(cli: str) -> str:
     return " ".join(filter(lambda opt: "auth" not in opt.lower(), cli.split()))
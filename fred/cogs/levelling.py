@@ -1,54 +1,160 @@
 from __future__ import annotations
 
+import asyncio
 import math
 from datetime import *
+from os import getenv
+from typing import Optional
 
+from attr import dataclass
 from nextcord import DMChannel, Message, Guild
+from nextcord.ext import tasks
 
 from .. import config
-from ..libraries import common
+from ..libraries import common, db
+from ..libraries.cache import TTLCache
+from ..libraries.metrics import metrics
 
 logger = common.new_logger(__name__)
 
+FLUSH_INTERVAL = float(getenv("FRED_LEVELLING_FLUSH_INTERVAL", 5))  # seconds
+ACTIVE_USERS = 10_000  # how many users' levels are kept in memory
+ACTIVE_FOR = 15 * 60  # seconds a user's levels stay in memory after they were last needed
+
+
+@dataclass
+class UserLevels:
+    """What levelling knows about a user, including changes that haven't been written to the DB yet."""
+
+    user_id: int
+    message_count: int = 0
+    xp_count: float = 0
+    xp_multiplier: float = 1
+    role_xp_multiplier: float = 1
+    rank: int = 0
+    rank_role_id: Optional[int] = None
+
+
+@dataclass
+class PendingLevels:
+    messages: int = 0  # added since the last flush
+    xp: float = 0  # likewise
+    rank: int = 0
+    rank_role_id: Optional[int] = None
+
+
+class LevelBuffer:
+    """Holds levelling changes in memory and writes them every `FLUSH_INTERVAL` seconds, all users in one statement,
+    instead of writing every message's changes as they happen. Reads go through here too, so they see the changes."""
+
+    def __init__(self):
+        self.users: TTLCache[int, UserLevels] = TTLCache(maxsize=ACTIVE_USERS, ttl=ACTIVE_FOR)
+        self._pending: dict[int, PendingLevels] = {}
+        # held while flushing, so nobody reads a user from the DB halfway through their changes being written
+        self._lock = asyncio.Lock()
+
+    async def get(self, user_id: int) -> UserLevels:
+        if (levels := self.users.get(user_id)) is not None:
+            return levels
+        async with self._lock:
+            if (levels := self.users.get(user_id)) is None:
+                row = await db.run(config.Users.fetch_levels, user_id)
+                levels = UserLevels(**row) if row is not None else UserLevels(user_id=user_id)
+                if (pending := self._pending.get(user_id)) is not None:  # forgotten before its changes were written
+                    levels.message_count += pending.messages
+                    levels.xp_count += pending.xp
+                    levels.rank, levels.rank_role_id = pending.rank, pending.rank_role_id
+                self.users.set(user_id, levels)
+        return levels
+
+    def forget(self, user_id: int):
+        """Drops what we know about someone, e.g. because something was changed in the DB directly."""
+        self.users.pop(user_id)
+
+    def _pending_for(self, levels: UserLevels) -> PendingLevels:
+        if (pending := self._pending.get(levels.user_id)) is None:
+            pending = self._pending[levels.user_id] = PendingLevels(rank=levels.rank, rank_role_id=levels.rank_role_id)
+        self.users.set(levels.user_id, levels)  # still in use, so keep it around
+        return pending
+
+    def count_message(self, levels: UserLevels):
+        levels.message_count += 1
+        self._pending_for(levels).messages += 1
+
+    def add_xp(self, levels: UserLevels, xp: float):
+        levels.xp_count += xp
+        self._pending_for(levels).xp += xp
+
+    def set_rank(self, levels: UserLevels, rank: int):
+        levels.rank = self._pending_for(levels).rank = rank
+
+    def set_rank_role(self, levels: UserLevels, role_id: int):
+        levels.rank_role_id = self._pending_for(levels).rank_role_id = role_id
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            changes = [
+                (user_id, change.messages, change.xp, change.rank, change.rank_role_id)
+                for user_id, change in pending.items()
+            ]
+            try:
+                with metrics.timed("levelling_flush"):
+                    # shielded, a write that has started finishes even if we're cancelled, so it mustn't be redone
+                    await asyncio.shield(db.run(config.Users.apply_level_changes, changes))
+            except Exception:
+                self._restore(pending)
+                raise
+            metrics.count("levelling_users_flushed", len(changes))
+
+    def _restore(self, pending: dict[int, PendingLevels]):
+        """Puts changes that couldn't be written back, under any that were made while we tried."""
+        for user_id, change in pending.items():
+            if (newer := self._pending.get(user_id)) is None:
+                self._pending[user_id] = change
+            else:
+                newer.messages += change.messages
+                newer.xp += change.xp
+
+
+level_buffer = LevelBuffer()
+
 
 class UserProfile:
-    def __init__(self, user_id: int, guild: Guild):
+    def __init__(self, levels: UserLevels, guild: Guild):
         self.guild = guild
-        self.user_id = user_id
+        self.user_id = levels.user_id
+        self.levels = levels
 
-        self.member = guild.get_member(user_id)
+        self.member = guild.get_member(self.user_id)
         if self.member is None:
-            logger.warning(f"Unable to retrieve information about user {user_id}")
+            logger.warning(f"Unable to retrieve information about user {self.user_id}")
             # Silencing error about this, Later™ problem -Borketh
             # raise MemberNotFound(f"Unable to retrieve information about user {user_id}")
 
         logger.info(f"Found member id {self.member}")
 
-        if DB_user := config.Users.fetch(user_id):
-            self.DB_user = DB_user
-        else:
-            self.DB_user = config.Users(user_id=user_id)
-
-        self._rank: int = DB_user.rank
-        self._xp_count: float = DB_user.xp_count
+    @classmethod
+    async def fetch(cls, user_id: int, guild: Guild) -> UserProfile:
+        return cls(await level_buffer.get(user_id), guild)
 
     @property
     def rank(self) -> int:
-        return self._rank
+        return self.levels.rank
 
     @rank.setter
     def rank(self, value: int):
-        self._rank = value
-        self.DB_user.rank = value
+        level_buffer.set_rank(self.levels, value)
 
     @property
     def xp_count(self) -> float:
-        return self._xp_count
+        return self.levels.xp_count
 
     @xp_count.setter
     def xp_count(self, value: float):
-        self._xp_count = value
-        self.DB_user.xp_count = value
+        level_buffer.add_xp(self.levels, value - self.levels.xp_count)
 
     async def try_resolve_member(self):
         if self.member is None:
@@ -66,7 +172,7 @@ class UserProfile:
             )
             return
         logpayload = common.user_info(self.member)
-        if role_id := config.RankRoles.fetch_by_rank(self.rank):
+        if role_id := await db.run(config.RankRoles.fetch_by_rank, self.rank):
             role = self.guild.get_role(role_id)
             if not role:
                 logpayload["role_id"] = role_id
@@ -75,11 +181,12 @@ class UserProfile:
                     extra=logpayload,
                 )
                 return
-            self.DB_user.rank_role_id = role_id
+            level_buffer.set_rank_role(self.levels, role_id)
 
             if not await common.permission_check(self.member, level=6):
                 for member_role in self.member.roles:
-                    if config.RankRoles.fetch_by_role(member_role.id) is not None:  # i.e. member_role is a rank role
+                    # i.e. member_role is a rank role
+                    if await db.run(config.RankRoles.fetch_by_role, member_role.id) is not None:
                         logpayload["role_id"] = member_role.id
                         logger.info(
                             "Removing a mismatched level role from someone",
@@ -126,7 +233,7 @@ class UserProfile:
         await self.validate_role()
 
     async def increment_xp(self):
-        xp_gain = config.Misc.fetch("xp_gain_value") * self.DB_user.xp_multiplier * self.DB_user.role_xp_multiplier
+        xp_gain = config.Misc.fetch("xp_gain_value") * self.levels.xp_multiplier * self.levels.role_xp_multiplier
         logpayload = common.user_info(self.member)
         logpayload["xp_increment"] = xp_gain
         logger.info("Incrementing someone's xp", logpayload)
@@ -168,6 +275,21 @@ class Levelling(common.FredCog):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.xp_timers = {}
+        self.flush.start()
+
+    def cog_unload(self):
+        self.flush.cancel()
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush(self):
+        try:
+            await level_buffer.flush()
+        except Exception as e:  # noqa - the changes are kept and we try again next time
+            self.logger.error(f"Unable to write levelling changes: {e!r}")
+
+    @flush.after_loop
+    async def _after_flush(self):
+        await level_buffer.flush()  # whatever is left when we're stopped
 
     # TODO make xp roles
     # @commonn.FredCog.listener()
@@ -186,8 +308,8 @@ class Levelling(common.FredCog):
         ):
             return
 
-        profile = UserProfile(message.author.id, message.guild)
-        profile.DB_user.message_count += 1
+        profile = await UserProfile.fetch(message.author.id, message.guild)
+        level_buffer.count_message(profile.levels)
         if profile.user_id in self.xp_timers:
             if datetime.now() >= self.xp_timers[profile.user_id]:
                 await profile.increment_xp()
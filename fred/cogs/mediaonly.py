@@ -1,7 +1,7 @@
 from nextcord import Message, Thread, ForumChannel
 
 from .. import config
-from ..libraries import common
+from ..libraries import common, db
 from ..libraries.common import FredCog
 
 
@@ -13,12 +13,12 @@ class MediaOnly(FredCog):
             if (
                 isinstance(message.channel.parent, ForumChannel)
                 and message.id == message.channel.id  # we only care if it's the initial post
-                and config.MediaOnlyChannels.check(message.channel.parent_id)  # last because it's a DB call
+                and await db.run(config.MediaOnlyChannels.check, message.channel.parent_id)  # last, it's a DB call
             ):
                 return await self._process_message(message, thread=True)
             else:
                 return False
-        elif config.MediaOnlyChannels.check(message.channel.id):
+        elif await db.run(config.MediaOnlyChannels.check, message.channel.id):
             return await self._process_message(message, thread=False)
 
         return False
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from os import getenv
+from typing import Optional
+
+from nextcord.ext import tasks
+
+from .. import config
+from ..libraries import db
+from ..libraries.common import FredCog
+from ..libraries.metrics import metrics
+from ..libraries.smr import ModInfo, SMLVersions
+
+SYNC_INTERVAL = int(getenv("FRED_SMR_MIRROR_INTERVAL", 10))  # minutes
+FULL_SYNC_INTERVAL = 24 * 3600  # seconds, also catches mods that were removed from SMR
+PAGE_SIZE = 100  # the most SMR gives out per query
+# a full sync that finds fewer than this share of the mods we have is more likely a glitch than mods being removed
+FULL_SYNC_MIN_FOUND = 0.9
+
+# fmt: off
+_MODS_QUERY = """
+{
+  getMods(filter: {limit: %d, offset: %d, order_by: updated_at, order: desc}) {
+    count
+    mods {
+      mod_reference
+      name
+      updated_at
+      versions(filter: {limit: 1, order: desc}) {
+        version
+      }
+      compatibility {
+        EA {
+          state
+          note
+        }
+        EXP {
+          state
+          note
+        }
+      }
+    }
+  }
+}
+"""
+
+_SML_VERSIONS_QUERY = """
+{
+  getSMLVersions {
+    sml_versions {
+      version
+      satisfactory_version
+    }
+  }
+}
+"""
+# fmt: on
+
+
+def _parse_time(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp)
+
+
+def _from_query(mod: dict) -> config.SMRModDict:
+    return config.SMRModDict(
+        mod_reference=mod["mod_reference"],
+        name=mod["name"],
+        latest_version=mod["versions"][0]["version"] if mod["versions"] else None,
+        compatibility=mod["compatibility"],
+        updated_at=mod["updated_at"],
+    )
+
+
+class SMRMirror(FredCog):
+    """Keeps a copy of every mod's latest version and compatibility, so crash analysis doesn't have to ask SMR.
+    The copy lives in the DB, so it survives restarts, and in memory, which is what gets read."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mods: dict[str, config.SMRModDict] = {}
+        self.sml_versions: Optional[SMLVersions] = None
+        self.synced_at: Optional[float] = None  # time.time() of the last successful sync, including loads from the DB
+        self._last_full_sync = float("-inf")
+        self.failures = 0
+        self.sync.start()
+
+    def cog_unload(self):
+        self.sync.cancel()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.mods)
+
+    def mod_info(self, mod_reference: str, branch: str) -> Optional[ModInfo]:
+        if (mod := self.mods.get(mod_reference)) is None:
+            return None
+        return ModInfo.from_mirror(mod, branch)
+
+    def stats(self) -> str:
+        if self.synced_at is None:
+            return f"SMR mirror: empty, {self.failures} failed syncs"
+        return (
+            f"SMR mirror: {len(self.mods)} mods, synced {time.time() - self.synced_at:.0f}s ago, "
+            f"{self.failures} failed syncs"
+        )
+
+    def _load(self):
+        mods = config.SMRMods.fetch_all()
+        sml_versions = config.Misc.fetch("smr_sml_versions")
+        synced_at = config.Misc.fetch("smr_mirror_synced_at")
+        return mods, sml_versions, synced_at
+
+    async def _fetch_changed_mods(self, since: Optional[datetime]) -> list[config.SMRModDict]:
+        """Pages through the mods, most recently updated first, until we reach ones we already have."""
+        changed: list[config.SMRModDict] = []
+        offset = 0
+        while True:
+            with metrics.timed("smr_sync"):
+                result = await self.bot.repository_query(_MODS_QUERY % (PAGE_SIZE, offset))
+            page = result["data"]["getMods"]["mods"]
+            changed.extend(_from_query(mod) for mod in page)
+            offset += PAGE_SIZE
+
+            if len(page) < PAGE_SIZE:
+                return changed
+            # mods updated at the same moment as the newest one we have are fetched again, which is harmless
+            if since is not None and _parse_time(page[-1]["updated_at"]) < since:
+                return changed
+
+    async def _sync(self):
+        full = time.time() - self._last_full_sync > FULL_SYNC_INTERVAL or not self.mods
+        since = None
+        if not full:
+            since = max(_parse_time(mod["updated_at"]) for mod in self.mods.values())
+
+        changed = await self._fetch_changed_mods(since)
+        if full:
+            found = len({mod["mod_reference"] for mod in changed})
+            if not found:
+                raise RuntimeError("SMR returned no mods for a full sync")
+            if found < len(self.mods) * FULL_SYNC_MIN_FOUND:
+                # keep what we have, and try a full sync again next time
+                self.logger.warning(f"A full sync only found {found} of our {len(self.mods)} mods, not removing any")
+                full = False
+        with metrics.timed("smr_sync"):
+            sml_versions = (await self.bot.repository_query(_SML_VERSIONS_QUERY))["data"]["getSMLVersions"]
+
+        mods = {} if full else dict(self.mods)  # a full sync drops mods that are gone from SMR
+        mods.update((mod["mod_reference"], mod) for mod in changed)
+        synced_at = time.time()
+
+        def store():
+            config.SMRMods.store(changed, prune=full)
+            config.Misc.create_or_change("smr_sml_versions", sml_versions["sml_versions"])
+            config.Misc.create_or_change("smr_mirror_synced_at", synced_at)
+
+        await db.run(store)
+        # swapped in whole, so readers never see a half-applied sync
+        self.mods = mods
+        self.sml_versions = SMLVersions(sml_versions["sml_versions"])
+        self.synced_at = synced_at
+        if full:
+            self._last_full_sync = synced_at
+        self.logger.info(f"Synced {len(changed)} mods from SMR ({'full' if full else 'incremental'})")
+
+    @tasks.loop(minutes=SYNC_INTERVAL)
+    async def sync(self):
+        try:
+            await self._sync()
+        except Exception as e:  # noqa - whatever went wrong, we keep the copy we have and try again next time
+            self.failures += 1
+            self.logger.error(f"Unable to sync the SMR mirror: {e!r}")
+
+    @sync.before_loop
+    async def _before_sync(self):
+        await self.bot.wait_until_ready()
+        mods, sml_versions, synced_at = await db.run(self._load)
+        self.mods = {mod["mod_reference"]: mod for mod in mods}
+        if sml_versions:
+            self.sml_versions = SMLVersions(sml_versions)
+        if self.mods:
+            self.synced_at = synced_at
+        self.logger.info(f"Loaded {len(self.mods)} mirrored mods from the DB")
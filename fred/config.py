@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 import pathlib
 from numbers import Number
@@ -68,6 +69,16 @@ class XpRoles(SQLObject):
         return XpRoles.selectBy(role_id=role_id).getOne(None)
 
 
+class UserLevelsDict(TypedDict):
+    user_id: int
+    message_count: int
+    xp_count: float
+    xp_multiplier: float
+    role_xp_multiplier: float
+    rank: int
+    rank_role_id: Optional[int]
+
+
 class Users(SQLObject):
     user_id = BigIntCol()
     message_count = IntCol(default=0)
@@ -92,9 +103,63 @@ class Users(SQLObject):
     def fetch(user_id: int) -> Users:
         return Users.selectBy(user_id=user_id).getOne(None)
 
+    @staticmethod
+    def _columns() -> str:
+        return ", ".join(column.dbName for column in Users.sqlmeta.columnList)
+
+    @staticmethod
+    def _new_row(**values) -> str:
+        """The SQL values of a new user for every column in `_columns()`, using the defaults declared above for the
+        columns not in `values`. For raw inserts, so they can't drift from what SQLObject would insert."""
+        connection = sqlhub.processConnection
+        return ", ".join(
+            connection.sqlrepr(values[column.dbName] if column.dbName in values else column.default)
+            for column in Users.sqlmeta.columnList
+        )
+
     @staticmethod
     def create_if_missing(user: nextcord.User | nextcord.Member) -> Users:
-        return Users.selectBy(user_id=user.id).getOne(False) or Users(user_id=user.id)
+        # one statement, so two instances seeing the same new user can't both create them. The no-op update is there
+        # so an existing row is returned too
+        connection = sqlhub.processConnection
+        columns = Users._columns()
+        row = connection.queryOne(
+            f"INSERT INTO users ({columns}) VALUES ({Users._new_row(user_id=user.id)}) "
+            "ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id "
+            f"RETURNING id, {columns}"
+        )
+        return Users.get(row[0], selectResults=row[1:])
+
+    @staticmethod
+    def fetch_levels(user_id: int) -> Optional[UserLevelsDict]:
+        if (user := Users.fetch(user_id)) is None:
+            return None
+        return UserLevelsDict(
+            user_id=user.user_id,
+            message_count=user.message_count,
+            xp_count=user.xp_count,
+            xp_multiplier=user.xp_multiplier,
+            role_xp_multiplier=user.role_xp_multiplier,
+            rank=user.rank,
+            rank_role_id=user.rank_role_id,
+        )
+
+    @staticmethod
+    def apply_level_changes(changes: list[tuple[int, int, float, int, Optional[int]]]):
+        """Applies (user_id, messages, xp, rank, rank_role_id) for many users in one statement. Messages and xp are
+        added to what's there, the rank and rank role replace it. Users that don't exist yet are created."""
+        rows = ", ".join(
+            f"({Users._new_row(user_id=user_id, message_count=messages, xp_count=xp, rank=rank, rank_role_id=role)})"
+            for user_id, messages, xp, rank, role in changes
+        )
+        sqlhub.processConnection.query(
+            f"INSERT INTO users ({Users._columns()}) VALUES {rows} "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "message_count = users.message_count + EXCLUDED.message_count, "
+            "xp_count = users.xp_count + EXCLUDED.xp_count, "
+            "rank = EXCLUDED.rank, "
+            "rank_role_id = EXCLUDED.rank_role_id"
+        )
 
 
 class ActionColours(SQLObject):
@@ -164,11 +229,21 @@ class Commands(SQLObject):
         query = Commands.selectBy()
         return [cmd.as_dict() for cmd in query.lazyIter()]
 
+    @staticmethod
+    def version() -> int:
+        # bumped whenever the commands change, so every instance can notice
+        return Misc.fetch("commands_version") or 0
+
+    @staticmethod
+    def bump_version():
+        Misc.increment("commands_version")
+
 
 class Crashes(SQLObject):
     name = StringCol()
     crash = StringCol()
     response = StringCol()
+    whole_file = BoolCol(default=False)  # the crash can only be matched against the entire log at once
 
     def as_dict(self) -> CrashesDict:
         return dict(name=str(self.name), response=str(self.response), crash=str(self.crash))
@@ -196,6 +271,19 @@ class Crashes(SQLObject):
         query = Crashes.selectBy()
         return [crash.as_dict() for crash in query.lazyIter()]
 
+    @staticmethod
+    def fetch_whole_file_names() -> set[str]:
+        return {str(crash.name) for crash in Crashes.selectBy(whole_file=True)}
+
+    @staticmethod
+    def version() -> int:
+        # bumped whenever the crashes change, so every instance can notice
+        return Misc.fetch("crash_rules_version") or 0
+
+    @staticmethod
+    def bump_version():
+        Misc.increment("crash_rules_version")
+
 
 class ReservedCommands(SQLObject):
     class sqlmeta:
@@ -209,9 +297,100 @@ class ReservedCommands(SQLObject):
         return bool(query)
 
 
+class SMRModDict(TypedDict):
+    mod_reference: str
+    name: str
+    latest_version: Optional[str]
+    compatibility: Optional[dict[str, Optional[dict[str, str]]]]  # key: game branch
+    updated_at: str
+
+
+class SMRMods(SQLObject):
+    """Our copy of the mods on SMR, kept up to date by the SMRMirror cog."""
+
+    class sqlmeta:
+        table = "smr_mods"
+
+    mod_reference = StringCol()
+    name = StringCol()
+    latest_version = StringCol(default=None)
+    compatibility = JSONCol(default=None)
+    updated_at = StringCol()
+
+    def as_dict(self) -> SMRModDict:
+        return SMRModDict(
+            mod_reference=str(self.mod_reference),
+            name=str(self.name),
+            latest_version=self.latest_version,
+            compatibility=self.compatibility,
+            updated_at=str(self.updated_at),
+        )
+
+    @staticmethod
+    def fetch_all() -> list[SMRModDict]:
+        return [mod.as_dict() for mod in SMRMods.select().lazyIter()]
+
+    @staticmethod
+    def _row(mod: SMRModDict) -> tuple:
+        compatibility = None if mod["compatibility"] is None else json.dumps(mod["compatibility"])
+        return mod["mod_reference"], mod["name"], mod["latest_version"], compatibility, mod["updated_at"]
+
+    @staticmethod
+    def store(mods: list[SMRModDict], prune: bool = False):
+        """Adds or updates `mods`. With `prune`, mods that aren't in `mods` are removed, unless `mods` is empty."""
+        # one row per mod, or the upsert would try to change a row twice and fail
+        mods = list({mod["mod_reference"]: mod for mod in mods}.values())
+        connection = sqlhub.processConnection
+        statements = []
+        if prune and mods:  # pruning against nothing would empty the mirror, which is never what an SMR answer means
+            keep = ", ".join(connection.sqlrepr(mod["mod_reference"]) for mod in mods)
+            statements.append(f"DELETE FROM smr_mods WHERE mod_reference <> ALL(ARRAY[{keep}]::text[])")
+        if mods:
+            rows = ", ".join(f"({', '.join(map(connection.sqlrepr, SMRMods._row(mod)))})" for mod in mods)
+            statements.append(
+                "INSERT INTO smr_mods (mod_reference, name, latest_version, compatibility, updated_at) "
+                f"VALUES {rows} "
+                "ON CONFLICT (mod_reference) DO UPDATE SET "
+                "name = EXCLUDED.name, "
+                "latest_version = EXCLUDED.latest_version, "
+                "compatibility = EXCLUDED.compatibility, "
+                "updated_at = EXCLUDED.updated_at"
+            )
+        if statements:
+            # sent together, so they run as one transaction and nobody sees the mods pruned but not yet updated
+            connection.query("; ".join(statements))
+
+
 type JSONValue = Number | bool | str | list | dict
 
 
+class MiscSettings(TypedDict, total=False):
+    prefix: str
+    is_running: bool
+    main_guild_id: int
+    error_channel: int
+    githook_channel: int
+    welcome_message: str
+    latest_info: str
+    levelling_state: bool
+    base_level_value: float
+    level_value_multiplier: float
+    xp_gain_value: float
+    xp_gain_delay: float
+    migration_rev: int
+    crash_rules_version: int
+    commands_version: int
+    smr_sml_versions: list[dict]
+    smr_mirror_synced_at: float
+
+
+MISC_CHANNEL = "fred_misc"  # changed keys are announced here, so every instance can update its copy
+
+# every setting, read once and then kept up to date by the writes below and by notifications from other instances.
+# the values are shared, so don't modify them in place
+_settings: Optional[MiscSettings] = None
+
+
 class Misc(SQLObject):
     class sqlmeta:
         table = "miscellaneous"
@@ -220,23 +399,65 @@ class Misc(SQLObject):
     value = JSONCol()
 
     @staticmethod
-    def fetch(key: str) -> Optional[JSONValue]:
+    def _cache() -> MiscSettings:
+        return _settings if _settings is not None else Misc.load()
+
+    @staticmethod
+    def load() -> MiscSettings:
+        """Reads every setting from the DB into the cache."""
+        global _settings
+        _settings = {row.key: row.value for row in Misc.select()}  # type: ignore
+        return _settings
+
+    @staticmethod
+    def refresh(key: str):
+        """Rereads one setting into the cache, e.g. because another instance changed it."""
         query = Misc.selectBy(key=key).getOne(None)
-        return getattr(query, "value", None)
+        settings = Misc._cache()
+        if query is None:
+            settings.pop(key, None)
+        else:
+            settings[key] = query.value
+
+    @staticmethod
+    def fetch(key: str) -> Optional[JSONValue]:
+        return Misc._cache().get(key)
+
+    @staticmethod
+    def _changed(key: str, value: JSONValue):
+        Misc._cache()[key] = value
+        connection = sqlhub.processConnection
+        connection.query(f"NOTIFY {MISC_CHANNEL}, {connection.sqlrepr(key)}")
 
     @staticmethod
     def change(key: str, value: JSONValue):
         query = Misc.selectBy(key=key).getOne(None)
         if query is not None:
             query.value = value
+            Misc._changed(key, value)
+
+    @staticmethod
+    def increment(key: str) -> int:
+        """Adds one to a counter, starting it at 1 if it doesn't exist yet."""
+        # incremented in the DB rather than from our copy, so two changes at once can't both write the same value.
+        # needs the unique index on key from migration 6
+        connection = sqlhub.processConnection
+        (value,) = connection.queryOne(
+            f"INSERT INTO miscellaneous (key, value) VALUES ({connection.sqlrepr(key)}, '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = (miscellaneous.value::integer + 1)::text "
+            "RETURNING value"
+        )
+        Misc._changed(key, int(value))
+        return int(value)
 
     @staticmethod
     def create_or_change(key: str, value: JSONValue):
-        query: Optional[Misc] = Misc.selectBy(key=key).getOne(None)
-        if query is None:
-            Misc(key=key, value=value)
-        else:
-            query.value = value
+        connection = sqlhub.processConnection
+        connection.query(
+            f"INSERT INTO miscellaneous (key, value) VALUES ({connection.sqlrepr(key)}, "
+            f"{connection.sqlrepr(json.dumps(value))}) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+        )
+        Misc._changed(key, value)
 
 
 def migrate():
@@ -245,7 +466,7 @@ def migrate():
         current_migration_rev = 0
 
     migrations_dir = pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
-    migrations_filenames = list(migrations_dir.glob("migrations/*-*.up.sql"))
+    migrations_filenames = sorted(migrations_dir.glob("migrations/*-*.up.sql"), key=_migration_rev)
     valid_migrations = [
         migration for migration in migrations_filenames if _migration_rev(migration) > current_migration_rev
     ]
@@ -254,7 +475,7 @@ def migrate():
         sqlhub.processConnection.query(migration.read_text())
 
     try:
-        Misc.create_or_change("migration_rev", _migration_rev(migrations_filenames[0]))
+        Misc.create_or_change("migration_rev", max(current_migration_rev, _migration_rev(migrations_filenames[-1])))
     except DuplicateEntryError as e:
         print(f"UNABLE TO RUN MIGRATION DUE TO {e}")
 
@@ -1,14 +1,13 @@
 from __future__ import annotations
 
 import asyncio
-import io
+import re
 import sys
 import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor
 from importlib.metadata import version
 from os import getenv
-from os.path import split
 from typing import Optional
 from urllib.parse import urlparse
 
@@ -18,12 +17,23 @@ import sqlobject as sql
 from nextcord.ext import commands
 
 from . import config
-from .cogs import crashes, mediaonly, webhooklistener, welcome, levelling
+from .cogs import crashes, mediaonly, webhooklistener, welcome, levelling, smrmirror
 from .fred_commands import Commands, FredHelpEmbed
-from .libraries import createembed, common
+from .libraries import createembed, common, db
+from .libraries.attachments import AttachmentStore
+from .libraries.cache import SingleFlight
+from .libraries.circuit_breaker import CircuitBreaker
+from .libraries.metrics import metrics
 
 __version__ = version("fred")
 
+HTTP_CONNECTION_LIMIT = int(getenv("FRED_HTTP_CONNECTION_LIMIT", 100))
+HTTP_PER_HOST_LIMIT = int(getenv("FRED_HTTP_PER_HOST_LIMIT", 20))
+# the total has to leave room for downloading a 100 MiB attachment
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=120, connect=10, sock_read=30)
+SMR_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=15)
+SMR_API_URL = getenv("FRED_SMR_API_URL", "https://api.ficsit.app/v2/query")
+
 from .libraries.common import text2file
 
 
@@ -32,7 +42,7 @@ class Bot(commands.Bot):
     async def isAlive(self: Bot):
         try:
             self.logger.info("Healthcheck: Attempting DB fetch")
-            _ = config.Misc.get(1)
+            _ = await db.run(config.Misc.get, 1)
             self.logger.info("Healthcheck: Creating user fetch")
             coro = self.fetch_user(227473074616795137)
             self.logger.info("Healthcheck: Executing user fetch")
@@ -56,12 +66,33 @@ class Bot(commands.Bot):
         self.web_session: aiohttp.ClientSession = ...  # type: ignore
         self.loop = asyncio.get_event_loop()
         self.executor = ThreadPoolExecutor()
+        # identical SMR queries that are in flight, so concurrent callers can share the one request
+        self._smr_queries: SingleFlight[str, dict] = SingleFlight("SMR queries")
+        self.breakers: dict[str, CircuitBreaker] = {}  # key: host
+        self.attachments = AttachmentStore(self.url_get_if_changed)
         self.error_channel: int = int(config.Misc.fetch("error_channel")) or 748229790825185311  # type: ignore
 
     async def start(self, *args, **kwargs):
-        async with aiohttp.ClientSession() as session:
-            self.web_session = session
-            return await super().start(*args, **kwargs)
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_CONNECTION_LIMIT,
+            limit_per_host=HTTP_PER_HOST_LIMIT,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,  # SMR gets queried constantly, so keep its connections around
+        )
+        settings_listener = asyncio.create_task(db.listen_for_setting_changes(self.db_uri))
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT) as session:
+                self.web_session = session
+                return await super().start(*args, **kwargs)
+        finally:
+            settings_listener.cancel()
+
+    async def close(self):
+        try:
+            await levelling.level_buffer.flush()
+        except Exception as e:  # noqa - shutting down regardless
+            self.logger.error(f"Unable to write the last levelling changes: {e!r}")
+        await super().close()
 
     @staticmethod
     def is_running():
@@ -92,6 +123,8 @@ class Bot(commands.Bot):
                 sql.sqlhub.processConnection = connection
                 config.migrate()
                 self.logger.debug("Applied migration.")
+                config.Misc.load()  # the migrations may have changed settings
+                self.db_uri = uri
                 break
             except sql.dberrors.OperationalError:
                 self.logger.error(f"Could not connect to the DB on attempt {attempt}")
@@ -107,6 +140,7 @@ class Bot(commands.Bot):
         self.add_cog(webhooklistener.Githook(self))
         self.add_cog(mediaonly.MediaOnly(self))
         self.add_cog(crashes.Crashes(self))
+        self.add_cog(smrmirror.SMRMirror(self))
         self.add_cog(welcome.Welcome(self))
         self.add_cog(levelling.Levelling(self))
 
@@ -120,6 +154,10 @@ class Bot(commands.Bot):
     def Crashes(self) -> crashes.Crashes:
         return self.get_cog("Crashes")  # noqa
 
+    @property
+    def SMRMirror(self) -> smrmirror.SMRMirror:
+        return self.get_cog("SMRMirror")  # noqa
+
     @property
     def Welcome(self) -> welcome.Welcome:
         return self.get_cog("Welcome")  # noqa
@@ -185,7 +223,7 @@ class Bot(commands.Bot):
 
         self.logger.info("Sending a DM", extra=common.user_info(user))
         if not user_meta:
-            user_meta = config.Users.create_if_missing(user)
+            user_meta = await db.run(config.Users.create_if_missing, user)
 
         if not user_meta.accepts_dms and not in_dm:
             self.logger.info("The user refuses to have DMs sent to them")
@@ -205,7 +243,7 @@ class Bot(commands.Bot):
             return False
 
     async def send_safe_direct_message(self, user: nextcord.User | nextcord.Member, content=None, **kwargs) -> bool:
-        user_meta = config.Users.create_if_missing(user)
+        user_meta = await db.run(config.Users.create_if_missing, user)
         try:
             return await self._send_safe_direct_message_internal(user, content, user_meta=user_meta, **kwargs)
         except (nextcord.HTTPException, nextcord.Forbidden):
@@ -303,6 +341,10 @@ class Bot(commands.Bot):
             await self.reply_to_msg(message, "Invalid bool string. Aborting")
             raise ValueError(f"Could not convert {s} to bool")
 
+    @staticmethod
+    def _set_accepts_dms(user_id: int, accepts_dms: bool):
+        config.Users.fetch(user_id).accepts_dms = accepts_dms
+
     async def on_message(self, message: nextcord.Message):
         self.logger.info("Processing a message", extra=common.message_info(message))
         if (is_bot := message.author.bot) or not self.is_running():
@@ -314,7 +356,7 @@ class Bot(commands.Bot):
         if isinstance(message.channel, nextcord.DMChannel):
             self.logger.info("Processing a DM", extra=common.message_info(message))
             if message.content.lower() == "start":
-                config.Users.fetch(message.author.id).accepts_dms = True
+                await db.run(self._set_accepts_dms, message.author.id, True)
                 self.logger.info(
                     "A user now accepts to receive DMs",
                     extra=common.message_info(message),
@@ -325,7 +367,7 @@ class Bot(commands.Bot):
                 )
                 return
             elif message.content.lower() == "stop":
-                config.Users.fetch(message.author.id).accepts_dms = False
+                await db.run(self._set_accepts_dms, message.author.id, False)
                 self.logger.info(
                     "A user now refuses to receive DMs",
                     extra=common.message_info(message),
@@ -347,18 +389,40 @@ class Bot(commands.Bot):
                 _reacted = await self.Crashes.process_message(message)
         self.logger.info("Finished processing a message", extra=common.message_info(message))
 
-    async def repository_query(self, query: str):
+    def breaker(self, url: str) -> CircuitBreaker:
+        """The circuit breaker for the host `url` is on, shared by everything that calls that host."""
+        host = urlparse(url).hostname or url
+        if (breaker := self.breakers.get(host)) is None:
+            breaker = self.breakers[host] = CircuitBreaker(host)
+        return breaker
+
+    async def repository_query(self, query: str) -> dict:
+        """Runs a GraphQL query against SMR. If the same query is already in flight, waits for that one instead.
+        The result may be shared between callers, so don't modify it."""
+        if query in self._smr_queries:
+            metrics.count("smr_coalesced")
+            self.logger.info("Identical SMR query already in flight, sharing it")
+        return await self._smr_queries.run(query, lambda: self._repository_query(query))
+
+    async def _repository_query(self, query: str) -> dict:
         self.logger.info(f"SMR query of length {len(query)} requested")
-
-        async with await self.web_session.post("https://api.ficsit.app/v2/query", json={"query": query}) as response:
-            response.raise_for_status()
-            self.logger.info(f"SMR query returned with response {response.status}")
-            value = await response.json()
-            self.logger.info("SMR response decoded")
-            return value
+        # named after the first thing it asks for (skipping any alias), e.g. getMods
+        kind = match.group(1) if (match := re.search(r"{\s*(?:\w+\s*:\s*)?(\w+)", query)) else "unknown"
+
+        with metrics.timed(f"smr_{kind}"):
+            async with (
+                self.breaker(SMR_API_URL).guard(),
+                await self.web_session.post(SMR_API_URL, json={"query": query}, timeout=SMR_TIMEOUT) as response,
+            ):
+                response.raise_for_status()
+                self.logger.info(f"SMR query returned with response {response.status}")
+                value = await response.json()
+                self.logger.info("SMR response decoded")
+                return value
 
     async def async_url_get(self, url: str, /, get: type = bytes) -> str | bytes | dict:
-        async with self.web_session.get(url) as response:
+        url = common.redirect_url(url)
+        async with self.breaker(url).guard(), self.web_session.get(url) as response:
             self.logger.info(f"Requested {get} from {url} with response {response.status}")
 
             if get == dict:
@@ -370,8 +434,27 @@ class Bot(commands.Bot):
         self.logger.info(f"Data has length of {len(rtn)}")
         return rtn
 
+    async def url_get_if_changed(
+        self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+    ) -> tuple[Optional[bytes], Optional[str], Optional[str]]:
+        """Downloads `url` unless it still matches the validators we have for it, in which case the data is None.
+        Returns the data along with the validators to send next time."""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        url = common.redirect_url(url)
+        # attachments can be big, so a slow download doesn't mean the host is struggling
+        async with self.breaker(url).guard(slow_calls=False), self.web_session.get(url, headers=headers) as response:
+            self.logger.info(f"Requested {url} with response {response.status}")
+            etag = response.headers.get("ETag", etag)
+            last_modified = response.headers.get("Last-Modified", last_modified)
+            if response.status == 304 and headers:
+                return None, etag, last_modified
+            response.raise_for_status()
+            return await response.read(), etag, last_modified
+
     async def obtain_attachment(self, url: str) -> nextcord.File:
-        async with self.web_session.get(url) as resp:
-            buff = io.BytesIO(await resp.read())
-            _, filename = split(urlparse(url).path)
-            return nextcord.File(filename=filename, fp=buff, force_close=True)
+        return await self.attachments.file(url)
@@ -4,16 +4,17 @@ import asyncio
 import inspect
 import io
 import logging
-from os.path import split
+from os import getenv
+from typing import Optional
 from urllib.parse import urlparse
 
 import nextcord
-import re2
+from algoliasearch.http.hosts import Host, HostsCollection
 from algoliasearch.search.client import SearchClient
+from algoliasearch.search.config import SearchConfig
 from nextcord import Interaction, SlashOption
-from nextcord.ext.commands.view import StringView
 
-from ._baseclass import BaseCmds, common, config, commands
+from ._baseclass import BaseCmds, common, commands
 from .bot_meta import BotCmds
 from .channels import ChannelCmds
 from .crashes import CrashCmds
@@ -21,17 +22,53 @@ from .dbcommands import CommandCmds
 from .experience import EXPCmds
 from .help import HelpCmds, FredHelpEmbed
 from ..libraries import createembed, ocr
+from ..libraries.cache import TTLCache
+from ..libraries.command_table import command_pattern, command_table, parse_arguments
+from ..libraries.metrics import metrics
 from ..libraries.view.mod_picker import ModPicker
 
+ALGOLIA_APP_ID = "2FDCZBLZ1A"
+ALGOLIA_API_KEY = "28531804beda52a04275ecd964db429d"  # search-only, it's public
+ALGOLIA_URL = getenv("FRED_ALGOLIA_URL")  # to search somewhere other than Algolia, e.g. benchmarks/fake_services.py
+DOCSEARCH_CACHE_SIZE = 512
+DOCSEARCH_CACHE_TTL = int(getenv("FRED_DOCSEARCH_CACHE_TTL", 6 * 3600))  # seconds, the docs don't change often
+AUTOCOMPLETE_LIMIT = 25  # the most Discord will show
+
+
+def _normalise_query(search: str) -> str:
+    return " ".join(search.lower().split())
+
 
 class Commands(BotCmds, ChannelCmds, CommandCmds, CrashCmds, EXPCmds, HelpCmds):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._docsearch_client: Optional[SearchClient] = None
+        # normalised query -> URL of the best hit
+        self.docsearch_cache: TTLCache[str, str] = TTLCache(maxsize=DOCSEARCH_CACHE_SIZE, ttl=DOCSEARCH_CACHE_TTL)
+
+    @property
+    def docsearch_client(self) -> SearchClient:
+        # one client for the bot's lifetime, so its connections get reused.
+        # made on first use rather than here because it wants a running event loop
+        if self._docsearch_client is None:
+            search_config = SearchConfig(ALGOLIA_APP_ID, ALGOLIA_API_KEY)
+            if ALGOLIA_URL:
+                url = urlparse(ALGOLIA_URL)
+                search_config.hosts = HostsCollection([Host(url.hostname, scheme=url.scheme, port=url.port)])
+            self._docsearch_client = SearchClient.create_with_config(search_config)
+        return self._docsearch_client
+
+    def cog_unload(self):
+        if self._docsearch_client is not None:
+            asyncio.create_task(self._docsearch_client.close())
+
     @BaseCmds.listener()
     async def on_command_error(self, ctx: commands.Context, error):
         # We get an error about commands being found when using "runtime" commands, so we have to ignore that
         self.logger.error(f"Caught {error!r}")
         if isinstance(error, commands.CommandNotFound):
             command = ctx.message.content.lower().lstrip(self.bot.command_prefix).split(" ")[0]
-            if config.Commands.fetch(command) is not None:
+            if (await command_table.get(self.bot.command_prefix)).get(command) is not None:
                 return
             self.logger.warning("Invalid command attempted")
             return
@@ -77,50 +114,20 @@ class Commands(BotCmds, ChannelCmds, CommandCmds, CrashCmds, EXPCmds, HelpCmds):
 
         prefix = self.bot.command_prefix
         self.logger.info("Processing a message", extra=common.message_info(message))
-        command_pattern = re2.compile(rf"{re2.escape(prefix)}(\S+)\s*(.*)")
-        if (match := re2.match(command_pattern, message.content)) is None:
+        if (match := command_pattern(prefix).match(message.content)) is None:
             return
 
         name, arguments = match.groups()
 
         self.logger.info(f"Processing the command {name}", extra=common.message_info(message))
 
-        if (command := config.Commands.fetch(name)) is None:
+        if (command := (await command_table.get(prefix)).get(name)) is None:
             return
 
-        if (
-            (content := command["content"])
-            and content.startswith(prefix)  # for linked aliases of commands like ff->rp
-            and (linked_command := config.Commands.fetch(content.lstrip(prefix)))
-        ):
-            command = linked_command
-            content = linked_command["content"]
-
-        if (attachment := command["attachment"]) is not None:
-            async with self.bot.web_session.get(attachment) as resp:
-                buff = io.BytesIO(await resp.read())
-                _, filename = split(urlparse(attachment).path)
-                attachment = nextcord.File(filename=filename, fp=buff, force_close=True)
-
-        args = []
-        view = StringView(arguments)
-        while not view.eof:
-            view.skip_ws()
-            args.append(view.get_quoted_word())
-
-        if content:
-            text = str(content)
-            substitutions = map(int, re2.findall(r"{(\d+)}", text))
-            for substitution in substitutions:
-                text = re2.sub(
-                    rf"\{{{substitution}\}}",
-                    (args[substitution] if substitution < len(args) else "(missing argument)"),
-                    text,
-                )
-            text = text.replace("{...}", " ".join(args) if args else "(no arguments given)")
-        else:
-            text = None
+        if (attachment := command.attachment) is not None:
+            attachment = await self.bot.obtain_attachment(attachment)
 
+        text = command.render(parse_arguments(arguments))
         await self.bot.reply_to_msg(message, text, file=attachment)
 
     #       Mod search command
@@ -233,31 +240,40 @@ class Commands(BotCmds, ChannelCmds, CommandCmds, CrashCmds, EXPCmds, HelpCmds):
         ephemeral: bool,
     ) -> None:
         self.logger.info(f"Searching the documentation. {search =}")
-        client: SearchClient = SearchClient("2FDCZBLZ1A", "28531804beda52a04275ecd964db429d")
-
-        query = await client.search_single_index(
-            index_name="ficsit",
-            search_params={
-                "query": search,
-                "facetFilters": [
-                    "component_name:satisfactory-modding",
-                    "component_version:latest",
-                ],
-            },
-        )
 
-        for hit in query.hits:
-            if hit.hierarchy["lvl0"].endswith("latest"):
-                await self.bot.reply_generic(
-                    ctx_or_interaction,
-                    f"This is the best result I got from the SMD :\n{hit.url}",
-                    ephemeral=ephemeral,
-                )
-                return
+        if (url := await self._best_doc_hit(search)) is not None:
+            await self.bot.reply_generic(
+                ctx_or_interaction,
+                f"This is the best result I got from the SMD :\n{url}",
+                ephemeral=ephemeral,
+            )
+            return
 
         # grumbus.
         await self.bot.reply_generic(ctx_or_interaction, f"No results found for `{search}`.")
 
+    async def _best_doc_hit(self, search: str) -> Optional[str]:
+        if (url := self.docsearch_cache.get(query := _normalise_query(search))) is not None:
+            return url
+
+        with metrics.timed("docsearch"):
+            result = await self.docsearch_client.search_single_index(
+                index_name="ficsit",
+                search_params={
+                    "query": search,
+                    "facetFilters": [
+                        "component_name:satisfactory-modding",
+                        "component_version:latest",
+                    ],
+                },
+            )
+
+        for hit in result.hits:
+            if hit.hierarchy["lvl0"].endswith("latest"):
+                self.docsearch_cache.set(query, hit.url)
+                return hit.url
+        return None
+
     @nextcord.slash_command(name="docsearch", description="Search SMR documentation")
     async def docsearch_slash(
         self,
@@ -267,6 +283,14 @@ class Commands(BotCmds, ChannelCmds, CommandCmds, CrashCmds, EXPCmds, HelpCmds):
     ):
         await self.handle_docsearch(interaction, search, ephemeral=ephemeral)
 
+    @docsearch_slash.on_autocomplete("search")
+    async def docsearch_autocomplete(self, interaction: Interaction, search: str):
+        # only what's been searched before, so typing never waits on Algolia, and picking one is answered from cache
+        search = _normalise_query(search or "")
+        recent = reversed(self.docsearch_cache.keys())
+        suggestions = [query for query in recent if search in query and len(query) <= 100]  # Discord's limit
+        await interaction.response.send_autocomplete(suggestions[:AUTOCOMPLETE_LIMIT])
+
     @commands.command(aliases=["docssearch"])
     async def docsearch(self, ctx: commands.Context, *, search: str) -> None:
         await self.handle_docsearch(ctx, search)
@@ -279,7 +303,7 @@ class Commands(BotCmds, ChannelCmds, CommandCmds, CrashCmds, EXPCmds, HelpCmds):
         for n, att in enumerate(ctx.message.attachments):
             with io.BytesIO() as img:
                 await att.save(img)
-                read_text = await self.bot.loop.run_in_executor(self.bot.executor, ocr.read, img)
+                read_text = await ocr.read_async(img)
             text += f"**Image {n}:**\n ```\n{read_text}\n```\n"
 
         await self.bot.reply_to_msg(ctx.message, text)
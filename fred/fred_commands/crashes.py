@@ -3,6 +3,12 @@ from nextcord import Interaction, SlashOption
 
 from ._baseclass import BaseCmds, commands, config, SearchFlags
 from ._command_utils import get_search
+from ..libraries import crash_rules
+from ..libraries.command_table import command_table
+from ..libraries.icon_cache import icon_cache
+from ..libraries.metrics import metrics
+from ..libraries.ocr import ocr_pool
+from ..libraries.regex_util import regex_pool
 
 
 class CrashCmds(BaseCmds):
@@ -40,6 +46,7 @@ class CrashCmds(BaseCmds):
             return
 
         config.Crashes(name=crash_name, crash=match, response=response)
+        crash_rules.rules_changed()
         await self.bot.reply_to_msg(ctx.message, "Known crash '" + crash_name + "' added!")
 
     @BaseCmds.remove.command(name="crash")
@@ -52,6 +59,7 @@ class CrashCmds(BaseCmds):
             return
 
         config.Crashes.deleteBy(name=crash_name)
+        crash_rules.rules_changed()
 
         await self.bot.reply_to_msg(ctx.message, "Crash removed!")
 
@@ -103,9 +111,76 @@ class CrashCmds(BaseCmds):
 
         crash.crash = checked_crash
         crash.response = checked_response
+        crash_rules.rules_changed()
 
         await self.bot.reply_to_msg(ctx.message, f"Crash '{name}' modified!")
 
+    @BaseCmds.set.command(name="crash_whole_file")
+    async def set_crash_whole_file(self, ctx: commands.Context, crash_name: str.lower, whole_file: bool):
+        """Usage: `set crash_whole_file (name) (true/false)`
+        Purpose: Marks whether a crash's regex can only match against an entire log at once.
+        Notes:
+            - Big logs are searched in chunks. Crashes marked this way are searched against the end of the log instead.
+            - Only needed if the regex spans a large part of the log."""
+        crash = config.Crashes.selectBy(name=crash_name).getOne(None)
+        if crash is None:
+            await self.bot.reply_to_msg(ctx.message, "Crash could not be found!")
+            return
+
+        crash.whole_file = whole_file
+        crash_rules.rules_changed()
+        state = "needs" if whole_file else "no longer needs"
+        await self.bot.reply_to_msg(ctx.message, f"Crash '{crash_name}' {state} the whole file!")
+
+    @BaseCmds.get.command(name="crashcache")
+    async def get_crashcache(self, ctx: commands.Context):
+        """Usage: `get crashcache`
+        Purpose: Shows how well the cache of analysed files is doing.
+        Notes: The cache forgets everything when I restart."""
+        cache = self.bot.Crashes.analysis_cache
+        await self.bot.reply_to_msg(ctx.message, f"Analysis cache: {cache.stats()}")
+
+    @BaseCmds.get.command(name="crashstats")
+    async def get_crashstats(self, ctx: commands.Context, count: int = 10):
+        """Usage: `get crashstats [count]`
+        Purpose: Shows where crash analysis spends its time, the slowest crash rules and the ones that never match.
+        Notes: Only rules that were actually run on their own get timed. The numbers reset when I restart."""
+        rules = await crash_rules.rule_cache.get(self.bot.command_prefix)
+        names = [crash.name for crash in rules.crashes]
+        stats = {name: metrics.rules[name] for name in names if name in metrics.rules}
+
+        lines = ["**Stages**"]
+        lines += [f"`{stage}`: {histogram.summary()}" for stage, histogram in sorted(metrics.stages.items())]
+        lines += [f"`{counter}`: {value}" for counter, value in sorted(metrics.counters.items())]
+        lines.append(f"Analysis cache: {self.bot.Crashes.analysis_cache.stats()}")
+        lines.append(f"Mod cache: {self.bot.Crashes.mod_cache.stats()}")
+        lines.append(self.bot.Crashes.sml_versions.stats())
+        lines.append(crash_rules.rule_cache.stats())
+        lines.append(command_table.stats())
+        if (mirror := self.bot.SMRMirror) is not None:
+            lines.append(mirror.stats())
+        lines.append(icon_cache.stats())
+        lines.append(self.bot.attachments.stats())
+        lines += [breaker.stats() for breaker in self.bot.breakers.values()]
+        for pool in (regex_pool, ocr_pool):
+            lines.append(
+                f"{pool.name} workers: {pool.busy}/{pool.size} busy, {pool.waiting} jobs waiting, {pool.respawns} respawns"
+            )
+
+        slowest = sorted(stats.items(), key=lambda item: item[1].time.mean, reverse=True)[:count]
+        lines.append(f"\n**Slowest {len(slowest)} rules** (by mean time)")
+        lines += [f"`{name}`: {rule.time.summary()}, {rule.hits} hits" for name, rule in slowest]
+
+        if timed_out := [(name, rule.timeouts) for name, rule in stats.items() if rule.timeouts]:
+            lines.append("\n**Rules that timed out**")
+            lines += [f"`{name}`: {timeouts} times" for name, timeouts in timed_out]
+
+        never_hit = [name for name in names if name not in stats or not stats[name].hits]
+        lines.append(f"\n**{len(never_hit)} of {len(names)} rules never matched**")
+        lines.append(", ".join(f"`{name}`" for name in never_hit) or "None!")
+
+        await self.bot.reply_to_msg(ctx.message, "\n".join(lines))
+
     #       Search Crashes Command
     @BaseCmds.search.command(name="crashes")
     async def search_crashes(self, ctx: commands.Context, pattern: str, *, flags: SearchFlags) -> None:
@@ -1,16 +1,11 @@
-import io
-from os.path import split
-from urllib.parse import urlparse
-
 import nextcord
-import re2
 from nextcord import Interaction, SlashOption, Member
-from nextcord.ext.commands.view import StringView
 from nextcord.interactions import MISSING
 
 from ._baseclass import BaseCmds, commands, SearchFlags
 from ._command_utils import get_search
 from .. import config
+from ..libraries.command_table import command_table, commands_changed, parse_arguments
 
 
 def _extract_prefix(string: str, prefix: str):
@@ -54,6 +49,9 @@ class CommandCmds(BaseCmds):
             content=response,
             attachment=attachment and attachment.url,
         )
+        commands_changed()
+        if attachment:
+            self.bot.attachments.prefetch(attachment.url)
 
         await self.bot.reply_to_msg(ctx.message, f"Command '{command_name}' added!")
         self.logger.info("Command {command_name} added with response '{response}'")
@@ -74,6 +72,7 @@ class CommandCmds(BaseCmds):
             if not delete:
                 return
         config.Commands.deleteBy(name=command_name)
+        commands_changed()
 
         await self.bot.reply_to_msg(ctx.message, "Command removed!")
         self.logger.info(f"Command {command_name} removed!")
@@ -123,6 +122,9 @@ class CommandCmds(BaseCmds):
         # this just works, don't touch it. trying to use config.Commands.fetch makes a duplicate command.
         results[0].content = new_response
         results[0].attachment = attachment and attachment.url
+        commands_changed()
+        if attachment:
+            self.bot.attachments.prefetch(attachment.url)
 
         await self.bot.reply_to_msg(ctx.message, f"Command '{command_name}' modified!")
         self.logger.info(f"Command {command_name} modified. New response: '{new_response}'")
@@ -156,6 +158,7 @@ class CommandCmds(BaseCmds):
 
         for alias in alias_checks["valid"]:
             config.Commands(name=alias, content=link, attachment=None)
+        commands_changed()
 
         if (num_aliases := len(alias_checks["valid"])) > 1:
             user_info = f"{num_aliases} aliases added for {target}: `{'`, `'.join(alias_checks['valid'])}`"
@@ -230,6 +233,7 @@ class CommandCmds(BaseCmds):
             return
         else:
             config.Commands.deleteBy(name=command_name)
+            commands_changed()
 
         await self.bot.reply_to_msg(ctx.message, "Alias removed!")
 
@@ -253,6 +257,7 @@ class CommandCmds(BaseCmds):
 
         # this just works, don't touch it. trying to use config.Commands.fetch makes a duplicate command.
         results[0].name = new_name
+        commands_changed()
 
         await self.bot.reply_to_msg(ctx.message, f"Command `{name}` is now `{new_name}`!")
 
@@ -300,7 +305,9 @@ class CommandCmds(BaseCmds):
     async def invoke_command_slash(
         self,
         interaction: Interaction,
-        command_name: str = SlashOption(description="The name of the command to invoke. Use /help commands or /search commands to see supported commands."),
+        command_name: str = SlashOption(
+            description="The name of the command to invoke. Use /help commands or /search commands to see supported commands."
+        ),
         arguments: str = SlashOption(
             description="Optional input to the command",
             required=False,
@@ -310,42 +317,15 @@ class CommandCmds(BaseCmds):
         ephemeral: bool = SlashOption(description="Only you can see the response", default=False),
     ):
         # Check if command exists
-        if not (command := config.Commands.fetch(command_name)):
+        table = await command_table.get(self.bot.command_prefix)
+        if (command := table.get(command_name)) is None:
             await interaction.response.send_message(f"Command '{command_name}' does not exist.", ephemeral=True)
             return
 
-        if (
-            (content := command["content"])
-            and content.startswith(self.bot.command_prefix)  # for linked aliases of commands like ff->rp
-            and (linked_command := config.Commands.fetch(content.lstrip(self.bot.command_prefix)))
-        ):
-            command = linked_command
-            content = linked_command["content"]
-
-        if (attachment := command.get("attachment")) is not None:
-            async with self.bot.web_session.get(attachment) as resp:
-                buff = io.BytesIO(await resp.read())
-                _, filename = split(urlparse(attachment).path)
-                attachment = nextcord.File(filename=filename, fp=buff, force_close=True)
-
-        args = []
-        view = StringView(arguments)
-        while not view.eof:
-            view.skip_ws()
-            args.append(view.get_quoted_word())
-
-        if content:
-            text = str(content)
-            substitutions = map(int, re2.findall(r"{(\d+)}", text))
-            for substitution in substitutions:
-                text = re2.sub(
-                    rf"\{{{substitution}\}}",
-                    (args[substitution] if substitution < len(args) else "(missing argument)"),
-                    text,
-                )
-            text = text.replace("{...}", " ".join(args) if args else "(no arguments given)")
-        else:
-            text = ""
+        if (attachment := command.attachment) is not None:
+            attachment = await self.bot.obtain_attachment(attachment)
+
+        text = command.render(parse_arguments(arguments)) or ""
 
         if ping_user and not ephemeral:
             text += f"\n-# {ping_user.mention}"
@@ -24,7 +24,7 @@ class EXPCmds(BaseCmds):
         Purpose: gives the indicated user the specified xp
         Notes: don't give negative xp, use take"""
         target: User
-        profile = levelling.UserProfile(target.id, ctx.guild)
+        profile = await levelling.UserProfile.fetch(target.id, ctx.guild)
         if amount < 0:
             await self.bot.reply_to_msg(
                 ctx.message,
@@ -44,7 +44,7 @@ class EXPCmds(BaseCmds):
         Purpose: takes the specified xp from the indicated user
         Notes: don't take negative xp, use give"""
         target: User
-        profile = levelling.UserProfile(target.id, ctx.guild)
+        profile = await levelling.UserProfile.fetch(target.id, ctx.guild)
         if amount < 0:
             await self.bot.reply_to_msg(
                 ctx.message,
@@ -70,6 +70,7 @@ class EXPCmds(BaseCmds):
         user_meta = config.Users.create_if_missing(target)
         amount = max(multiplier, 0)  # no negative gain allowed
         user_meta.xp_multiplier = amount
+        levelling.level_buffer.forget(target.id)
 
         if amount == 0:
             await self.bot.reply_to_msg(ctx.message, f"{target.name} has been banned from xp gain")
@@ -82,7 +83,7 @@ class EXPCmds(BaseCmds):
         Purpose: sets the user's xp amount to the specified amount
         Notes: don't try negative values, it won't work"""
         target: User
-        profile = levelling.UserProfile(target.id, ctx.guild)
+        profile = await levelling.UserProfile.fetch(target.id, ctx.guild)
 
         if amount < 0:
             await self.bot.reply_to_msg(ctx.message, "Negative numbers for xp are not allowed!")
@@ -145,6 +146,7 @@ class EXPCmds(BaseCmds):
 
     #      Leaderboard Command
     async def leaderboard_handler(self, ctx_or_interaction, ephemeral: bool) -> None:
+        await levelling.level_buffer.flush()  # so it's ranked by everyone's latest xp
         query = config.Users.select().orderBy("-xp_count").limit(10)
         results = list(query)
         if not results:
@@ -226,15 +228,15 @@ class EXPCmds(BaseCmds):
                 user = ctx_or_interaction.author
             elif isinstance(ctx_or_interaction, nextcord.Interaction):
                 user = ctx_or_interaction.user
-        user_meta = config.Users.create_if_missing(user)
+        levels = await levelling.level_buffer.get(user.id)
         if isinstance(ctx_or_interaction, commands.Context):
             await self.bot.reply_to_msg(
                 ctx_or_interaction.message,
-                f"{user.name} is level {user_meta.rank} with {user_meta.xp_count} xp",
+                f"{user.name} is level {levels.rank} with {levels.xp_count} xp",
             )
         elif isinstance(ctx_or_interaction, nextcord.Interaction):
             await ctx_or_interaction.response.send_message(
-                f"{user.name} is level {user_meta.rank} with {user_meta.xp_count} xp",
+                f"{user.name} is level {levels.rank} with {levels.xp_count} xp",
                 ephemeral=False,
             )
 
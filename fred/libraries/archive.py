@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import tempfile
+from os import getenv
+from typing import IO, Callable, Optional
+from zipfile import BadZipFile, ZipFile, LargeZipFile
+
+from attr import dataclass, Factory
+
+from .common import new_logger
+
+logger = new_logger(__name__)
+
+SPOOL_MEMORY_LIMIT = 8 * 1024 * 1024  # members bigger than this are kept on disk while we work on them
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ArchiveLimits:
+    member_size: int = int(getenv("FRED_ARCHIVE_MEMBER_SIZE_LIMIT", 100 * 1024 * 1024))
+    total_size: int = int(getenv("FRED_ARCHIVE_TOTAL_SIZE_LIMIT", 300 * 1024 * 1024))
+    depth: int = int(getenv("FRED_ARCHIVE_DEPTH_LIMIT", 2))  # 1 means no archives inside archives
+    member_count: int = int(getenv("FRED_ARCHIVE_MEMBER_COUNT_LIMIT", 200))
+
+
+@dataclass
+class ArchiveMember:
+    name: str  # the path within the archive
+    path: str  # the full path for display, including the archive(s) it's in
+    file: IO[bytes]
+
+
+@dataclass
+class ExtractedArchive:
+    path: str
+    members: list[ArchiveMember] = Factory(list)
+    archives: list[ExtractedArchive] = Factory(list)  # nested archives, already extracted
+    problems: list[str] = Factory(list)  # reasons some of the archive was left out
+
+    def member(self, name: str) -> Optional[ArchiveMember]:
+        return next((m for m in self.members if m.name == name), None)
+
+    def all_problems(self) -> list[str]:
+        return self.problems + [problem for archive in self.archives for problem in archive.all_problems()]
+
+    def close(self):
+        for member in self.members:
+            member.file.close()
+        for archive in self.archives:
+            archive.close()
+
+
+class _Budget:
+    def __init__(self, limits: ArchiveLimits):
+        self.limits = limits
+        self.bytes_left = limits.total_size
+        self.members_left = limits.member_count
+
+
+class _MemberTooBig(Exception):
+    pass
+
+
+def _copy_bounded(source: IO[bytes], budget: _Budget) -> IO[bytes]:
+    """Copies a member out, giving up as soon as it goes over either budget.
+    The sizes in the zip's directory can lie, so we count what actually comes out."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+    written = 0
+    try:
+        while chunk := source.read(READ_CHUNK_SIZE):
+            written += len(chunk)
+            if written > budget.limits.member_size or written > budget.bytes_left:
+                raise _MemberTooBig
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    budget.bytes_left -= written
+    spool.seek(0)
+    return spool
+
+
+def _extract(
+    file: IO[bytes], path: str, accept: Callable[[str], bool], budget: _Budget, depth: int
+) -> ExtractedArchive:
+    archive = ExtractedArchive(path)
+    try:
+        zip_file = ZipFile(file)
+    except (BadZipFile, LargeZipFile) as e:
+        archive.problems.append(f"`{path}` isn't a zip I can read ({e})")
+        return archive
+
+    with zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir() or not accept(info.filename):
+                continue  # skipped before decompressing anything
+
+            member_path = f"{path}/{info.filename}"
+            if budget.members_left <= 0:
+                archive.problems.append(f"`{path}` has too many files, I stopped at `{info.filename}`")
+                break
+            if info.file_size > budget.limits.member_size:
+                archive.problems.append(f"`{member_path}` is too big")
+                continue
+            if info.file_size > budget.bytes_left:
+                archive.problems.append(f"`{path}` is too big in total, I stopped at `{info.filename}`")
+                break
+
+            is_archive = info.filename.rpartition(".")[-1].lower() == "zip"
+            if is_archive and depth >= budget.limits.depth:
+                archive.problems.append(f"`{member_path}` is nested too deep")
+                continue
+
+            budget.members_left -= 1
+            try:
+                with zip_file.open(info) as source:
+                    content = _copy_bounded(source, budget)
+            except _MemberTooBig:
+                archive.problems.append(f"`{member_path}` is bigger than it claims to be")
+                continue
+            except (BadZipFile, NotImplementedError, RuntimeError, OSError) as e:
+                archive.problems.append(f"`{member_path}` couldn't be extracted ({e})")
+                continue
+
+            if is_archive:
+                with content:
+                    archive.archives.append(_extract(content, member_path, accept, budget, depth + 1))
+            else:
+                archive.members.append(ArchiveMember(info.filename, member_path, content))
+
+    return archive
+
+
+def extract_archive(
+    file: IO[bytes], path: str, accept: Callable[[str], bool], limits: ArchiveLimits = ArchiveLimits()
+) -> ExtractedArchive:
+    """Extracts every member of a zip (and of the zips inside it) that `accept` wants, within `limits`.
+    This blocks, so run it in a thread. Close the result once done with the members."""
+    archive = _extract(file, path, accept, _Budget(limits), 1)
+    for problem in archive.all_problems():
+        logger.warning(f"While extracting {path}: {problem}")
+    return archive
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import tempfile
+import time
+from collections import OrderedDict
+from io import BytesIO
+from os import getenv
+from os.path import split
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, TypedDict
+from urllib.parse import urlparse
+
+import nextcord
+
+from .cache import DiskCache, SingleFlight
+from .common import new_logger
+from .metrics import metrics
+
+logger = new_logger(__name__)
+
+ATTACHMENT_DIR = getenv("FRED_ATTACHMENT_DIR")  # defaults to a directory in the system temp dir
+ATTACHMENT_MEMORY = int(getenv("FRED_ATTACHMENT_MEMORY_MB", 32)) * 1024 * 1024
+ATTACHMENT_DISK = int(getenv("FRED_ATTACHMENT_DISK_MB", 512)) * 1024 * 1024
+ATTACHMENT_FRESH_FOR = int(getenv("FRED_ATTACHMENT_FRESH_FOR", 3600))  # seconds before checking for a new version
+
+# url, etag, last modified -> data (None if unchanged), etag, last modified
+type ConditionalGet = Callable[
+    [str, Optional[str], Optional[str]], Awaitable[tuple[Optional[bytes], Optional[str], Optional[str]]]
+]
+
+
+class AttachmentMeta(TypedDict):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    checked: float  # time.time() of the last time we got or confirmed this file
+
+
+class AttachmentStore:
+    """The files that commands and crash responses reply with, so they aren't downloaded every time they're sent.
+    Recently used files are kept in memory up to `memory_bytes`, the rest spill to disk. Files older than `fresh_for`
+    are still served straight away, but checked for a new version in the background."""
+
+    def __init__(
+        self,
+        fetch: ConditionalGet,
+        directory: Optional[str] = ATTACHMENT_DIR,
+        memory_bytes: int = ATTACHMENT_MEMORY,
+        disk_bytes: int = ATTACHMENT_DISK,
+        fresh_for: float = ATTACHMENT_FRESH_FOR,
+    ):
+        self._fetch = fetch
+        self.disk = DiskCache(Path(directory or Path(tempfile.gettempdir()) / "fred-attachments"), disk_bytes)
+        self.memory_bytes = memory_bytes
+        self.fresh_for = fresh_for
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.downloads = 0
+        self._memory: OrderedDict[str, tuple[AttachmentMeta, bytes]] = OrderedDict()
+        self._memory_used = 0
+        self._inflight: SingleFlight[str, bytes] = SingleFlight("attachments", log_failures=True)
+
+    def _remember(self, meta: AttachmentMeta, data: bytes) -> list[tuple[AttachmentMeta, bytes]]:
+        """Puts a file in memory, returning what had to make room for it so it can be written to disk."""
+        if (old := self._memory.pop(meta["url"], None)) is not None:
+            self._memory_used -= len(old[1])
+        self._memory[meta["url"]] = (meta, data)
+        self._memory_used += len(data)
+        spilled = []
+        while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted[1])
+            spilled.append(evicted)
+        return spilled
+
+    def _spill(self, spilled: list[tuple[AttachmentMeta, bytes]]):
+        for meta, data in spilled:
+            self.disk.write(meta["url"], meta, data)
+
+    async def _download(self, url: str, cached: Optional[tuple[AttachmentMeta, bytes]]) -> bytes:
+        etag, last_modified = (cached[0]["etag"], cached[0]["last_modified"]) if cached else (None, None)
+        try:
+            with metrics.timed("attachment_download"):
+                data, etag, last_modified = await self._fetch(url, etag, last_modified)
+        except Exception as e:  # noqa - the copy we have is better than nothing
+            if cached is None:
+                raise
+            logger.warning(f"Unable to revalidate {url}, still using the copy we have: {e!r}")
+            return cached[1]
+
+        if data is None:
+            data = cached[1]
+        else:
+            self.downloads += 1
+        meta = AttachmentMeta(url=url, etag=etag, last_modified=last_modified, checked=time.time())
+        spilled = self._remember(meta, data)
+        await asyncio.to_thread(self._spill, spilled)
+        return data
+
+    async def get(self, url: str) -> bytes:
+        if (cached := self._memory.get(url)) is not None:
+            self._memory.move_to_end(url)
+            self.memory_hits += 1
+        elif (cached := await asyncio.to_thread(self.disk.read, url)) is not None:
+            self.disk_hits += 1
+            await asyncio.to_thread(self._spill, self._remember(*cached))
+        else:
+            return await self._inflight.run(url, lambda: self._download(url, None))
+
+        if time.time() - cached[0]["checked"] >= self.fresh_for:
+            # in the background, this time the old copy is fine
+            self._inflight.start(url, lambda: self._download(url, cached))
+        return cached[1]
+
+    def prefetch(self, url: str):
+        """Starts downloading a file we'll be asked for soon, e.g. one a command was just given."""
+        if url not in self._memory and url not in self._inflight:
+            self._inflight.start(url, lambda: self._download(url, None))
+
+    async def file(self, url: str) -> nextcord.File:
+        data = await self.get(url)
+        _, filename = split(urlparse(url).path)
+        return nextcord.File(BytesIO(data), filename=filename, force_close=True)
+
+    def stats(self) -> str:
+        return (
+            f"Attachments: {len(self._memory)} in memory ({self._memory_used / 1024 / 1024:.1f} MiB), "
+            f"{self.memory_hits} memory hits, {self.disk_hits} disk hits, {self.downloads} downloads"
+        )
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from .common import new_logger
+
+logger = new_logger(__name__)
+
+
+class TTLCache[K, V]:
+    """A small LRU cache whose entries also expire after `ttl` seconds.
+    Keeps hit/miss counters so we can tell whether it's pulling its weight."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        if (entry := self._data.get(key)) is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        if (entry := self._data.pop(key, None)) is not None:
+            return entry[1]
+        return default
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self) -> list[K]:
+        """The keys that haven't expired, least recently used first."""
+        now = time.monotonic()
+        return [key for key, (expires, _) in self._data.items() if expires > now]
+
+    def __contains__(self, key: K) -> bool:
+        return (entry := self._data.get(key)) is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"{len(self)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate)"
+        )
+
+
+class SingleFlight[K, V]:
+    """Runs at most one fetch per key at a time. Asking for a key that is already being fetched waits for that fetch
+    instead of starting another one. Waiting is shielded, so one caller giving up doesn't cancel it for everyone."""
+
+    def __init__(self, name: str, log_failures: bool = False):
+        self.name = name
+        self.log_failures = log_failures  # for fetches that may have nobody waiting on them, like background refreshes
+        self._inflight: dict[K, asyncio.Task[V]] = {}
+
+    def start(self, key: K, fetch: Callable[[], Awaitable[V]]) -> asyncio.Task[V]:
+        """Starts fetching `key` unless that's already happening, without waiting for it."""
+        if (task := self._inflight.get(key)) is None:
+            task = asyncio.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    async def run(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        return await asyncio.shield(self.start(key, fetch))
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._inflight
+
+    def _done(self, key: K, task: asyncio.Task[V]):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # everyone waiting may have given up, so the error is marked as seen here
+        if not task.cancelled() and (e := task.exception()) is not None and self.log_failures:
+            logger.warning(f"Unable to fetch {key} for {self.name}: {e!r}")
+
+
+class RefreshingValue[T]:
+    """A single value that is fetched on first use and refreshed in the background once it is older than `ttl`.
+    The old value keeps being served while a refresh runs, or if refreshes fail, until it is `max_stale` seconds old.
+    Concurrent callers share one fetch."""
+
+    def __init__(self, name: str, fetch: Callable[[], Awaitable[T]], ttl: float, max_stale: float, retry: float = 60):
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.retry = retry  # how long to wait before trying again after a failed refresh
+        self.failures = 0
+        self._fetch = fetch
+        self._value: Optional[T] = None
+        self._fetched_at = float("-inf")
+        self._refresh_at = float("-inf")
+        self._refresh: SingleFlight[None, T] = SingleFlight(name)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self._fetched_at
+
+    async def get(self) -> T:
+        if self._value is not None and self.age < self.max_stale:
+            if time.monotonic() >= self._refresh_at:
+                self._refresh.start(None, self._do_refresh)
+            return self._value
+        # nothing usable, so this caller has to wait
+        return await self._refresh.run(None, self._do_refresh)
+
+    async def _do_refresh(self) -> T:
+        try:
+            value = await self._fetch()
+        except Exception as e:
+            self.failures += 1
+            self._refresh_at = time.monotonic() + self.retry
+            # background refreshes have nobody waiting on them, so their failures would otherwise go unseen
+            stale = ", still using the old value" if self._value is not None else ""
+            logger.warning(f"Unable to refresh {self.name}{stale}: {e!r}")
+            raise
+        self.set(value)
+        return value
+
+    @property
+    def needs_refresh(self) -> bool:
+        return self._value is None or time.monotonic() >= self._refresh_at
+
+    def set(self, value: T):
+        """Stores a value that was fetched some other way, e.g. as part of a bigger request."""
+        self._value = value
+        self._fetched_at = time.monotonic()
+        self._refresh_at = self._fetched_at + self.ttl
+
+    def invalidate(self):
+        self._refresh_at = float("-inf")
+
+    def stats(self) -> str:
+        if self._value is None:
+            return f"{self.name}: not fetched yet, {self.failures} failed refreshes"
+        return f"{self.name}: {self.age:.0f}s old, {self.failures} failed refreshes"
+
+
+class VersionedCache[K, T]:
+    """A single value for the whole process that is expensive to build, e.g. from a whole table, for one key at a time.
+    It's built on first use, and rebuilt when it's invalidated or when `version()` moves on because another instance
+    changed what it's built from. `version` is called on every `get`, so it has to be cheap, like reading a setting from
+    `config.Misc`. Concurrent callers share one build."""
+
+    def __init__(self, name: str, build: Callable[[K, int], Awaitable[T]], version: Callable[[], int]):
+        self.name = name
+        self.builds = 0
+        self._build = build
+        self._version = version
+        self._entry: Optional[tuple[K, int, T]] = None  # the key and version it was built for, and the value
+        self._lock = asyncio.Lock()
+        self._generation = 0  # bumped on invalidation, so a build that raced with a change isn't kept
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._entry[1] if self._entry is not None else None
+
+    def _current(self, key: K) -> Optional[T]:
+        if (entry := self._entry) is not None and entry[0] == key and entry[1] == self._version():
+            return entry[2]
+        return None
+
+    async def get(self, key: K) -> T:
+        if (value := self._current(key)) is not None:
+            return value
+
+        async with self._lock:
+            # someone else may have rebuilt it while we were waiting
+            if (value := self._current(key)) is None:
+                generation = self._generation
+                version = self._version()  # read first, so a change made during the build shows up as a newer version
+                value = await self._build(key, version)
+                self.builds += 1
+                if generation == self._generation:
+                    self._entry = (key, version, value)  # swapped in whole, so readers never see a half-built value
+            return value
+
+    def replace(self, key: K, version: int, value: T):
+        """Swaps in a value that was built elsewhere, e.g. from generated data."""
+        self._generation += 1
+        self._entry = (key, version, value)
+
+    def invalidate(self):
+        self._generation += 1
+        self._entry = None
+
+    def stats(self) -> str:
+        return f"{self.name}: version {self.version}, built {self.builds} times"
+
+
+class DiskCache:
+    """Blobs, each with a little JSON metadata, in a directory that is kept under `max_bytes` by deleting the least
+    recently used. Everything here blocks, so it's meant to be called in a thread."""
+
+    def __init__(self, directory: Path, max_bytes: int, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / f"{name}{self.suffix}", self.directory / f"{name}.json"
+
+    def read(self, key: str) -> Optional[tuple[dict[str, Any], bytes]]:
+        data_path, meta_path = self._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text())
+            data = data_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if meta.get("key") != key:
+            return None  # a hash collision, as unlikely as that is
+        data_path.touch()  # the mtime is what eviction goes by
+        return meta, data
+
+    def write(self, key: str, meta: dict[str, Any], data: Optional[bytes]):
+        """Stores the metadata, and the data unless it's None (i.e. unchanged), then trims the directory back under
+        `max_bytes`. Failing to write is logged rather than raised, a cache that can't save just saves nothing."""
+        data_path, meta_path = self._paths(key)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if data is not None:
+                # written aside and renamed, so a reader never sees half a file
+                tmp = data_path.with_suffix(".tmp")
+                tmp.write_bytes(data)
+                tmp.replace(data_path)
+            else:
+                data_path.touch()
+            meta_path.write_text(json.dumps(meta | {"key": key}))
+            self._evict()
+        except OSError as e:
+            logger.warning(f"Unable to store {key} in {self.directory}: {e!r}")
+
+    def _evict(self):
+        entries = []
+        for path in self.directory.glob(f"*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
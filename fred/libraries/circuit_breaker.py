@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import time
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import AsyncIterator
+
+from aiohttp import ClientConnectionError, ClientResponseError
+
+from .common import new_logger
+
+logger = new_logger(__name__)
+
+FAILURE_THRESHOLD = int(getenv("FRED_BREAKER_FAILURES", 5))
+SLOW_CALL_THRESHOLD = float(getenv("FRED_BREAKER_SLOW_CALL", 8))  # seconds, slower calls count as failures
+RESET_TIMEOUT = float(getenv("FRED_BREAKER_RESET", 30))  # seconds open before letting a trial call through
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+def is_host_failure(e: BaseException) -> bool:
+    """Whether an error says the host is in trouble, rather than e.g. that we asked for something that isn't there."""
+    if isinstance(e, ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (ClientConnectionError, ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """Stops calling a dependency for a while once it keeps failing or being slow, so callers fail fast instead of
+    all waiting on it. After `reset_timeout` one trial call is let through, and its outcome decides what's next."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        slow_call_threshold: float = SLOW_CALL_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0  # in a row
+        self.rejected = 0
+        self.times_opened = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls would currently be turned away."""
+        return self.state == "open" or (self.state == "half-open" and self._trial_running)
+
+    def _record_failure(self, reason: str):
+        self.failures += 1
+        if self._opened_at is not None or self.failures >= self.failure_threshold:
+            if self._opened_at is None:
+                self.times_opened += 1
+            logger.warning(f"Circuit for {self.name} is open after {self.failures} failures (last: {reason})")
+            self._opened_at = time.monotonic()
+
+    def _record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"Circuit for {self.name} is closed again")
+        self.failures = 0
+        self._opened_at = None
+
+    @asynccontextmanager
+    async def guard(self, slow_calls: bool = True) -> AsyncIterator[None]:
+        """Wraps one call to the dependency. Raises `CircuitOpenError` straight away if the circuit is open.
+        Only connection errors, timeouts and 5xx responses count as failures. With `slow_calls` off, e.g. for
+        downloads that take as long as they are big, slow calls don't count either."""
+        if self.is_open:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} is failing, not trying it for now")
+
+        trial = self.state == "half-open"
+        self._trial_running = trial
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_host_failure(e):
+                self._record_failure(repr(e))
+            else:
+                self._record_success()  # it answered, so it's up
+            raise
+        else:
+            if slow_calls and (duration := time.monotonic() - start) > self.slow_call_threshold:
+                self._record_failure(f"took {duration:.1f}s")
+            else:
+                self._record_success()
+        finally:
+            if trial:
+                self._trial_running = False
+
+    def stats(self) -> str:
+        return (
+            f"{self.name}: {self.state}, {self.failures} failures in a row, opened {self.times_opened} times, "
+            f"{self.rejected} calls turned away"
+        )
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from functools import lru_cache, partial
+from typing import Optional
+
+import re2
+from attr import dataclass
+from nextcord.ext.commands.view import StringView
+
+from .. import config
+from . import db
+from .cache import VersionedCache
+from .common import new_logger
+from .templates import ALL_ARGUMENTS, TemplateSegment, parse_template, render_template
+
+logger = new_logger(__name__)
+
+
+def parse_arguments(arguments: str) -> list[str]:
+    """Splits what came after a command's name the way nextcord does, so quoted arguments stay together."""
+    args = []
+    view = StringView(arguments)
+    while not view.eof:
+        view.skip_ws()
+        args.append(view.get_quoted_word())
+    return args
+
+
+@lru_cache(maxsize=4)
+def command_pattern(prefix: str) -> re2.Pattern:
+    """Matches a message that invokes a command, capturing the name and the arguments."""
+    return re2.compile(rf"{re2.escape(prefix)}(\S+)\s*(.*)")
+
+
+@dataclass(frozen=True)
+class RuntimeCommand:
+    name: str
+    content: Optional[str]  # as written, e.g. for crash rules that respond with the command
+    template: Optional[list[TemplateSegment]]  # None if the command only responds with an attachment
+    attachment: Optional[str]
+
+    def render(self, args: list[str]) -> Optional[str]:
+        if self.template is None:
+            return None
+
+        def fill(segment) -> str:
+            if segment is ALL_ARGUMENTS:
+                return " ".join(args) if args else "(no arguments given)"
+            return args[segment] if segment < len(args) else "(missing argument)"
+
+        return render_template(self.template, fill)
+
+
+@dataclass(frozen=True)
+class CommandTable:
+    version: int
+    commands: dict[str, RuntimeCommand]  # lower-cased name -> the command, with aliases already followed
+
+    def get(self, name: str) -> Optional[RuntimeCommand]:
+        return self.commands.get(name.lower())
+
+
+def _resolve(name: str, by_name: dict[str, config.CommandsDict], prefix: str) -> config.CommandsDict:
+    """Follows aliases like ff->rp to the command they end up at, or the last one that exists."""
+    command = by_name[name]
+    seen = {name}
+    while (content := command["content"]) and content.startswith(prefix):
+        target = content.lstrip(prefix).lower()
+        if target in seen or (linked := by_name.get(target)) is None:
+            break
+        seen.add(target)
+        command = linked
+    return command
+
+
+def build_table(version: int, prefix: str, commands: list[config.CommandsDict]) -> CommandTable:
+    by_name: dict[str, config.CommandsDict] = {}
+    for command in commands:
+        by_name.setdefault(command["name"].lower(), command)
+
+    table = {}
+    for name in by_name:
+        command = _resolve(name, by_name, prefix)
+        content = command["content"]
+        template = parse_template(str(content), all_arguments=True) if content else None
+        table[name] = RuntimeCommand(name, content or None, template, command["attachment"])
+
+    logger.info(f"Built the table of {len(table)} commands (version {version})")
+    return CommandTable(version, table)
+
+
+def _build(prefix: str, version: int) -> CommandTable:
+    return build_table(version, prefix, config.Commands.fetch_all())
+
+
+# the runtime commands for the whole process, so invoking one doesn't touch the DB
+command_table: VersionedCache[str, CommandTable] = VersionedCache(
+    "command table", partial(db.run, _build), config.Commands.version
+)
+
+
+def commands_changed():
+    """Call this after adding, modifying, removing or renaming a command or alias."""
+    config.Commands.bump_version()
+    command_table.invalidate()
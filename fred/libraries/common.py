@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from os import getenv
 from functools import lru_cache, singledispatch
 from io import BytesIO
 from typing import TYPE_CHECKING, Optional
@@ -25,6 +26,19 @@ def new_logger(name: str) -> logging.Logger:
 
 logger = new_logger(__name__)
 
+# points external services somewhere else, e.g. at the fakes in benchmarks/fake_services.py
+# as comma separated pairs of prefix=replacement, like "https://pastebin.com=http://localhost:8765/pastebin"
+URL_OVERRIDES: dict[str, str] = dict(
+    pair.split("=", 1) for pair in getenv("FRED_URL_OVERRIDES", "").split(",") if "=" in pair
+)
+
+
+def redirect_url(url: str) -> str:
+    for prefix, replacement in URL_OVERRIDES.items():
+        if url.startswith(prefix):
+            return replacement + url.removeprefix(prefix)
+    return url
+
 
 class FredCog(commands.Cog):
     bot: Bot = ...  # we can assume any cog will have a bot by the time it needs to be accessed
@@ -113,8 +127,10 @@ async def _permission_check_member(member: Member, *, threshold_level: int) -> b
         extra=logpayload,
     )
 
+    from . import db  # not at the top, db needs new_logger from here
+
     user_roles = {role.id for role in member.roles}
-    perm_roles = config.PermissionRoles.fetch_ge_lvl(threshold_level)
+    perm_roles = await db.run(config.PermissionRoles.fetch_ge_lvl, threshold_level)
     user_roles_above_threshold = {role for role in perm_roles if role.role_id in user_roles}
 
     if user_roles_above_threshold:
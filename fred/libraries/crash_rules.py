@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from functools import partial
+from typing import Optional
+
+import re2
+from attr import dataclass
+
+from .. import config
+from . import db
+from .cache import VersionedCache
+from .command_table import CommandTable
+from .common import new_logger
+from .createembed import CrashResponse
+from .regex_util import RuleSet
+from .templates import TemplateSegment, parse_template, render_template
+
+logger = new_logger(__name__)
+
+CRASH_FLAGS = re2.IGNORECASE | re2.S
+
+
+@dataclass(frozen=True)
+class CompiledCrash:
+    name: str
+    template: list[TemplateSegment]
+    # set if the response mirrors a command. It's looked up when responding, so changing commands doesn't mean
+    # recompiling the rules
+    command: Optional[str] = None
+
+    def respond(self, match, commands: Optional[CommandTable] = None) -> Optional[CrashResponse]:
+        """`commands` is only needed if the response mirrors a command."""
+        if self.command is not None:
+            if commands is None or (command := commands.get(self.command)) is None:
+                return None
+            return CrashResponse(name=self.name, value=command.content, attachment=command.attachment, inline=True)
+
+        captured = len(match.groups())
+
+        def fill(segment: int) -> str:
+            return match.group(segment) if segment <= captured else f"{{Group {segment} not captured in crash regex!}}"
+
+        return CrashResponse(name=self.name, value=render_template(self.template, fill), inline=True)
+
+
+@dataclass(frozen=True)
+class CompiledCrashRules:
+    version: int
+    crashes: list[CompiledCrash]
+    rule_set: RuleSet  # every rule, for text we have in full
+    # the same rules split up for logs we scan in chunks, with each subset's indices into `crashes`
+    chunked_indices: list[int]
+    chunked_rule_set: RuleSet
+    whole_file_indices: list[int]
+    whole_file_rule_set: RuleSet
+
+
+def compile_rules(
+    version: int, prefix: str, crashes: list[config.CrashesDict], whole_file_names: set[str]
+) -> CompiledCrashRules:
+    compiled = []
+    for crash in crashes:
+        response = str(crash["response"])
+        if response.startswith(prefix):
+            compiled.append(CompiledCrash(crash["name"], [], response.strip(prefix)))
+        else:
+            compiled.append(CompiledCrash(crash["name"], parse_template(response)))
+
+    patterns = [crash["crash"] for crash in crashes]
+    whole_file = [i for i, crash in enumerate(crashes) if crash["name"] in whole_file_names]
+    chunked = [i for i, crash in enumerate(crashes) if crash["name"] not in whole_file_names]
+
+    logger.info(f"Compiled {len(compiled)} crash rules (version {version}, {len(whole_file)} need the whole file)")
+    return CompiledCrashRules(
+        version,
+        compiled,
+        RuleSet(patterns, CRASH_FLAGS),
+        chunked,
+        RuleSet([patterns[i] for i in chunked], CRASH_FLAGS),
+        whole_file,
+        RuleSet([patterns[i] for i in whole_file], CRASH_FLAGS),
+    )
+
+
+def _build(prefix: str, version: int) -> CompiledCrashRules:
+    return compile_rules(version, prefix, config.Crashes.fetch_all(), config.Crashes.fetch_whole_file_names())
+
+
+# the compiled crash rules for the whole process
+rule_cache: VersionedCache[str, CompiledCrashRules] = VersionedCache(
+    "crash rules", partial(db.run, _build), config.Crashes.version
+)
+
+
+def rules_changed():
+    """Call this after anything that changes what the crash rules respond with."""
+    config.Crashes.bump_version()
+    rule_cache.invalidate()
@@ -6,7 +6,6 @@ from typing import TYPE_CHECKING, Optional
 from urllib.parse import quote as url_safe
 
 import nextcord
-from PIL import Image
 from attr import dataclass
 from nextcord.utils import format_dt
 
@@ -15,6 +14,7 @@ from .. import config
 if TYPE_CHECKING:
     from ..fred import Bot
 from ..libraries import common
+from ..libraries.icon_cache import icon_cache
 
 logger = common.new_logger(__name__)
 
@@ -358,19 +358,9 @@ def _multiple_mod_embed(original_query_name: str, mods: list[dict]) -> nextcord.
 
 
 async def webp_icon_as_png(url: str, bot: Bot) -> tuple[nextcord.File, str]:
-    with (
-        BytesIO(await bot.async_url_get(url)) as virtual_webp,
-        BytesIO() as virtual_png,
-    ):
-        webp_dat = Image.open(virtual_webp).convert("RGB")
-        webp_dat.save(virtual_png, "png")
-        virtual_png.seek(0)
-        filename = f"{url.split('/')[-2]}.png".strip()
-        file = nextcord.File(virtual_png, filename=filename)
-    return (
-        file,
-        filename,
-    )  # this is out of the ctx manager to ensure the buffers are closed
+    png = await icon_cache.get(url, bot)
+    filename = f"{url.split('/')[-2]}.png".strip()
+    return nextcord.File(BytesIO(png), filename=filename), filename
 
 
 # SMR Lookup Embed Formats
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Callable
+
+import psycopg
+
+from .. import config
+from .common import new_logger
+from .metrics import metrics
+
+logger = new_logger(__name__)
+
+DB_WORKERS = int(getenv("FRED_DB_WORKERS", 4))
+SLOW_QUERY = float(getenv("FRED_DB_SLOW_QUERY", 1))  # seconds, slower calls get logged
+LISTEN_RETRY = 30  # seconds to wait before listening again after losing the connection
+
+# SQLObject blocks, so DB calls get threads of their own. There are only a few, so a slow database makes DB calls
+# queue up rather than taking every thread the rest of the bot uses for blocking work.
+_executor = ThreadPoolExecutor(DB_WORKERS, thread_name_prefix="db")
+
+
+async def run[**P, T](func: Callable[P, T], /, *args: P.args, **kwargs: P.kwargs) -> T:
+    """Runs a blocking DB call, e.g. `await db.run(config.Commands.fetch, name)`, without holding up the event loop.
+    Each call is timed as the `db_<name>` stage, and the time spent waiting for a DB thread as `db_queue`."""
+    name = getattr(func, "__qualname__", None) or repr(func)
+    queued = time.perf_counter()
+    started = 0.0
+
+    def call() -> T:
+        nonlocal started
+        started = time.perf_counter()
+        return func(*args, **kwargs)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, call)
+    except Exception:
+        metrics.stages[f"db_{name}"].errors += 1
+        raise
+    finally:
+        if started:
+            duration = time.perf_counter() - started
+            metrics.stages["db_queue"].observe(started - queued)
+            metrics.stages[f"db_{name}"].observe(duration)
+            if duration > SLOW_QUERY:
+                logger.warning(f"DB call {name} took {duration:.2f}s")
+
+
+async def listen_for_setting_changes(uri: str):
+    """Keeps the cache of `config.Misc` in step with settings changed by other instances, which announce the keys
+    they change. Runs until cancelled, reconnecting whenever the connection drops."""
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(uri, autocommit=True) as connection:
+                await connection.execute(f"LISTEN {config.MISC_CHANNEL}")
+                await run(config.Misc.load)  # anything that changed while we weren't listening
+                async for notification in connection.notifies():
+                    await run(config.Misc.refresh, notification.payload)
+        except psycopg.Error as e:
+            logger.warning(f"Stopped listening for setting changes, trying again in {LISTEN_RETRY}s: {e!r}")
+            await asyncio.sleep(LISTEN_RETRY)
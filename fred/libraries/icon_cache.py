@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import tempfile
+import time
+from io import BytesIO
+from os import getenv
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, TypedDict
+
+from PIL import Image
+
+from .cache import DiskCache, SingleFlight, TTLCache
+from .common import new_logger
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from ..fred import Bot
+
+logger = new_logger(__name__)
+
+ICON_CACHE_DIR = getenv("FRED_ICON_CACHE_DIR")  # defaults to a directory in the system temp dir
+ICON_CACHE_SIZE = int(getenv("FRED_ICON_CACHE_MB", 64)) * 1024 * 1024  # bytes of PNGs kept on disk
+ICON_FRESH_FOR = int(getenv("FRED_ICON_FRESH_FOR", 3600))  # seconds before asking whether the logo changed
+HOT_ICONS = 128  # converted icons kept in memory
+
+
+class IconMeta(TypedDict):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    checked: float  # time.time() of the last time we got or confirmed this icon
+
+
+def _to_png(data: bytes) -> bytes:
+    with BytesIO(data) as virtual_webp, BytesIO() as virtual_png:
+        Image.open(virtual_webp).convert("RGB").save(virtual_png, "png")
+        return virtual_png.getvalue()
+
+
+class IconCache:
+    """Mod logos converted to PNG, kept on disk (bounded by `max_bytes`, least recently used go first) with the most
+    recent ones also in memory. Each icon is stored with the validator it was served with, so once it's
+    `fresh_for` seconds old we only ask whether it changed instead of downloading and converting it again."""
+
+    def __init__(self, directory: Optional[str], max_bytes: int, fresh_for: float, hot_size: int = HOT_ICONS):
+        self.disk = DiskCache(Path(directory or Path(tempfile.gettempdir()) / "fred-icons"), max_bytes, ".png")
+        self.fresh_for = fresh_for
+        # the hot tier doesn't expire on its own, freshness is tracked in the metadata
+        self.hot: TTLCache[str, tuple[IconMeta, bytes]] = TTLCache(maxsize=hot_size, ttl=float("inf"))
+        self.conversions = 0
+        self.revalidations = 0
+        self._inflight: SingleFlight[str, bytes] = SingleFlight("icons")
+
+    async def _fetch(self, url: str, bot: Bot) -> bytes:
+        cached = self.hot.get(url) or await asyncio.to_thread(self.disk.read, url)
+        if cached is not None:
+            meta, png = cached
+            if time.time() - meta["checked"] < self.fresh_for:
+                self.hot.set(url, cached)
+                return png
+
+        etag, last_modified = (cached[0]["etag"], cached[0]["last_modified"]) if cached else (None, None)
+        try:
+            with metrics.timed("icon_download"):
+                data, etag, last_modified = await bot.url_get_if_changed(url, etag, last_modified)
+        except Exception as e:  # noqa - an old logo is better than none
+            if cached is None:
+                raise
+            logger.warning(f"Unable to revalidate the icon for {url}, using the one we have: {e!r}")
+            return cached[1]
+
+        if data is None:
+            self.revalidations += 1
+            png = cached[1]
+        else:
+            self.conversions += 1
+            with metrics.timed("icon_convert"):
+                png = await asyncio.to_thread(_to_png, data)
+        meta = IconMeta(url=url, etag=etag, last_modified=last_modified, checked=time.time())
+
+        self.hot.set(url, (meta, png))
+        await asyncio.to_thread(self.disk.write, url, meta, None if data is None else png)
+        return png
+
+    async def get(self, url: str, bot: Bot) -> bytes:
+        """The logo at `url` as PNG. Concurrent lookups of the same logo share one download."""
+        return await self._inflight.run(url, lambda: self._fetch(url, bot))
+
+    def stats(self) -> str:
+        return (
+            f"Icons: {self.hot.stats()} in memory, {self.conversions} converted, "
+            f"{self.revalidations} revalidated unchanged"
+        )
+
+
+icon_cache = IconCache(ICON_CACHE_DIR, ICON_CACHE_SIZE, ICON_FRESH_FOR)
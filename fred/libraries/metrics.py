@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import bisect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+# upper bounds in seconds, anything slower lands in the last (unbounded) bucket
+_BUCKETS: tuple[float, ...] = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Histogram:
+    """Counts durations into fixed buckets, which is plenty to tell fast from slow without keeping every sample."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self._buckets = [0] * (len(_BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._buckets[bisect.bisect_left(_BUCKETS, seconds)] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket the q-th quantile falls in (the max, for the last bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, amount in zip(_BUCKETS, self._buckets):
+            seen += amount
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> str:
+        return (
+            f"n={self.count} p50={self.quantile(0.5) * 1000:.1f}ms p99={self.quantile(0.99) * 1000:.1f}ms "
+            f"max={self.max * 1000:.1f}ms" + (f" errors={self.errors}" if self.errors else "")
+        )
+
+
+class RuleStats:
+    def __init__(self):
+        self.hits = 0
+        self.timeouts = 0
+        self.time = Histogram()
+
+
+class Metrics:
+    """In-process numbers about what the bot spends its time on. They reset when the bot restarts."""
+
+    def __init__(self):
+        self.stages: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.rules: defaultdict[str, RuleStats] = defaultdict(RuleStats)
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        self.started = time.time()
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        histogram = self.stages[stage]
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            histogram.errors += 1
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def record_rule(self, name: str, seconds: float, hit: bool):
+        stats = self.rules[name]
+        stats.time.observe(seconds)
+        stats.hits += hit
+
+    def record_rule_timeout(self, name: str):
+        self.rules[name].timeouts += 1
+
+    def reset(self):
+        self.__init__()
+
+
+metrics = Metrics()
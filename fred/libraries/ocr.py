@@ -1,12 +1,21 @@
+import io
+import time
+from os import getenv
 from typing import IO
 
 from PIL import Image, ImageEnhance
 from pytesseract import image_to_string, TesseractError
 
 from fred.libraries.common import new_logger
+from fred.libraries.metrics import metrics
+from fred.libraries.process_pool import KillableProcessPool, WorkerDied, pool_size
 
 logger = new_logger(__name__)
 
+OCR_LIMIT: float = float(getenv("FRED_OCR_TIME_LIMIT", 30))
+# tesseract gets a bit less time than the worker, so it's stopped by pytesseract rather than orphaned by a kill
+TESSERACT_LIMIT: float = OCR_LIMIT * 0.8
+
 
 def read(file: IO):
     try:
@@ -27,7 +36,7 @@ def read(file: IO):
             logger.warning("Failed to enhance contrast.")
             logger.exception(e)
 
-        image_text = image_to_string(image)
+        image_text = image_to_string(image, timeout=TESSERACT_LIMIT)
         logger.info("OCR returned the following data:\n" + image_text)
         return image_text
 
@@ -35,3 +44,33 @@ def read(file: IO):
         logger.error(f"OCR error!")
         logger.exception(oops)
         return ""
+
+    except RuntimeError as oops:  # pytesseract's way of saying it timed out
+        logger.warning(f"OCR gave up: {oops}")
+        return ""
+
+
+def _read_bytes(data: bytes) -> str:
+    # runs in an OCR worker, files can't be sent there
+    return read(io.BytesIO(data))
+
+
+# OCR gets its own workers, so a flood of screenshots only ever queues behind other screenshots
+ocr_pool = KillableProcessPool("ocr", pool_size(getenv("FRED_OCR_WORKERS"), 2))
+
+
+async def read_async(file: IO[bytes]) -> str:
+    """Reads the text in an image in an OCR worker. Gives up with no text if it takes longer than `OCR_LIMIT`.
+    Cancelling this kills the worker, so nothing is left running for a message we stopped caring about."""
+    data = file.read()
+    queued = time.perf_counter()
+    async with ocr_pool.worker() as worker:
+        metrics.stages["ocr_queue"].observe(time.perf_counter() - queued)
+        try:
+            with metrics.timed("ocr"):
+                return await worker.call(_read_bytes, data, timeout=OCR_LIMIT)
+        except TimeoutError:
+            logger.warning(f"OCR of an image ({len(data)} bytes) took longer than {OCR_LIMIT} seconds, skipping it")
+        except WorkerDied as e:
+            logger.error(f"OCR worker died reading an image ({len(data)} bytes): {e}")
+    return ""
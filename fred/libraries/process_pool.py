@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from contextlib import asynccontextmanager
+from multiprocessing.connection import Connection
+from typing import Any, AsyncIterator, Callable, Optional
+
+from .common import new_logger
+
+logger = new_logger(__name__)
+
+# spawn rather than fork, the bot has threads and sockets we don't want to duplicate
+_mp_context = multiprocessing.get_context("spawn")
+
+# in a worker, shared with the parent so it can see how far a killed job got, and whether it's still getting anywhere
+_progress = None
+_steps = None
+
+STALL_POLL = 4  # times per stall timeout that a job's progress is checked
+
+
+def report_progress(value: int):
+    """Records how far the current job has got, starting a new step. Does nothing outside a worker."""
+    if _progress is not None:
+        _progress.value = value
+        _steps.value += 1
+
+
+def _worker_main(conn: Connection, progress, steps):
+    global _progress, _steps
+    _progress = progress
+    _steps = steps
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        progress.value = -1
+        try:
+            result = (True, func(*args))
+        except Exception as e:  # noqa - everything gets reported back to the parent
+            result = (False, e)
+
+        try:
+            conn.send(result)
+        except Exception as e:  # noqa - the result or exception didn't pickle
+            conn.send((False, RuntimeError(f"Unable to send result back from worker: {e!r}")))
+
+
+class WorkerDied(RuntimeError):
+    pass
+
+
+class WorkerStalled(TimeoutError):
+    """A single step of a job (see `report_progress`) took longer than it was allowed."""
+
+
+class Worker:
+    """A single worker process. Runs one call at a time, and is killed if a call overruns its timeout."""
+
+    def __init__(self, name: str):
+        self._conn, child_conn = _mp_context.Pipe()
+        self._progress = _mp_context.Value("q", -1, lock=False)
+        self._steps = _mp_context.Value("q", 0, lock=False)
+        self.process = _mp_context.Process(
+            target=_worker_main, args=(child_conn, self._progress, self._steps), name=name, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        # whatever the pool's user wants to remember about this worker, e.g. what state it has loaded
+        self.meta: dict[str, Any] = {}
+
+    @property
+    def progress(self) -> int:
+        """What the last job passed to `report_progress`, or -1. Still readable after the worker is killed."""
+        return self._progress.value
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self, sending: Optional[asyncio.Future] = None):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        if sending is None or sending.done():
+            self._conn.close()
+        else:
+            # a thread is still writing to the connection. It fails fast now nothing's reading, then it can be closed
+            def close(_sending: asyncio.Future):
+                _sending.exception()  # the broken pipe, which is expected
+                self._conn.close()
+
+            sending.add_done_callback(close)
+
+    async def _wait_readable(self, stall_timeout: Optional[float]):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self._conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            if stall_timeout is None:
+                await ready
+                return
+            steps, since = self._steps.value, loop.time()
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(ready), stall_timeout / STALL_POLL)
+                    return
+                except TimeoutError:
+                    if self._steps.value != steps:
+                        steps, since = self._steps.value, loop.time()
+                    elif loop.time() - since >= stall_timeout:
+                        raise WorkerStalled(f"Worker {self.process.name} spent over {stall_timeout}s on one step")
+        finally:
+            loop.remove_reader(fd)
+
+    async def call[R](self, func: Callable[..., R], *args, timeout: float, stall_timeout: Optional[float] = None) -> R:
+        """Runs `func(*args)` in the worker. `func` must be importable (i.e. defined at module level).
+        If it takes longer than `timeout` seconds, or we get cancelled while waiting, the worker is killed.
+        With `stall_timeout`, it's also killed (raising `WorkerStalled`) when a single step takes longer than that."""
+        # pickling and writing the arguments (e.g. a whole log) blocks, so it happens in a thread
+        sending = asyncio.get_running_loop().run_in_executor(None, self._conn.send, (func, args))
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.shield(sending)  # shielded, so we can tell when the thread is done with the connection
+                await self._wait_readable(stall_timeout)
+            ok, value = self._conn.recv()
+        except (TimeoutError, asyncio.CancelledError):
+            logger.warning(f"Killing worker {self.process.name} mid-job")
+            self.kill(sending)
+            raise
+        except (EOFError, BrokenPipeError) as e:
+            self.kill(sending)
+            raise WorkerDied(f"Worker {self.process.name} died (exit code {self.process.exitcode})") from e
+
+        if not ok:
+            raise value
+        return value
+
+
+class KillableProcessPool:
+    """A fixed-size pool of worker processes that can be hard-killed and replaced when a job overruns.
+    Unlike the default executor, a job that times out doesn't keep using up a worker."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.waiting = 0  # jobs waiting for a free worker
+        self.respawns = 0
+        self._idle: asyncio.Queue[Worker] = asyncio.Queue()
+        self._workers: list[Worker] = []
+        self._spawned = 0
+        self.closed = False
+
+    def _spawn(self) -> Worker:
+        self._spawned += 1
+        worker = Worker(f"{self.name}-{self._spawned}")
+        self._workers.append(worker)
+        return worker
+
+    def _start(self):
+        # started lazily, so nothing gets spawned just by importing things
+        logger.info(f"Starting {self.size} {self.name} workers")
+        for _ in range(self.size):
+            self._idle.put_nowait(self._spawn())
+
+    @asynccontextmanager
+    async def worker(self) -> AsyncIterator[Worker]:
+        if self.closed:
+            raise RuntimeError(f"The {self.name} pool has been shut down")
+        if not self._workers:
+            self._start()
+
+        self.waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self.waiting -= 1
+
+        try:
+            yield worker
+        finally:
+            # a worker we no longer track was out when the pool was shut down, and has been killed since
+            if worker in self._workers:
+                if not worker.alive:
+                    self._workers.remove(worker)
+                    self.respawns += 1
+                    worker = self._spawn()
+                self._idle.put_nowait(worker)
+
+    async def run[R](self, func: Callable[..., R], *args, timeout: float) -> R:
+        async with self.worker() as worker:
+            return await worker.call(func, *args, timeout=timeout)
+
+    @property
+    def busy(self) -> int:
+        return len(self._workers) - self._idle.qsize()
+
+    def shutdown(self):
+        self.closed = True
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+        self._idle = asyncio.Queue()
+
+
+def pool_size(requested: Optional[str], default: int) -> int:
+    try:
+        return max(1, int(requested)) if requested else default
+    except ValueError:
+        logger.warning(f"Invalid pool size {requested!r}, using {default}")
+        return default
@@ -1,24 +1,291 @@
-import asyncio
+from __future__ import annotations
+
 import re as regex_fallback
+import time
+from os import getenv
+from typing import Optional
 
 import re2
 
-REGEX_LIMIT: float = 6.9
+from .common import new_logger
+from .process_pool import KillableProcessPool, WorkerStalled, pool_size, report_progress
+
+REGEX_LIMIT: float = 6.9  # seconds a single pattern, or a single combined pass of a rule set, may take
+RULE_LOAD_LIMIT: float = 30  # compiling a few thousand patterns in a fresh worker can take a while
 
 re2.set_fallback_module(regex_fallback)
 
+logger = new_logger(__name__)
+
+# How many rules go into each combined pattern. Bigger ones need fewer passes, but RE2's DFA for them gets big enough
+# to run out of memory and fall back to its much slower NFA.
+PREFILTER_CHUNK = 64
+PREFILTER_CACHE = 64  # combined patterns kept per rule set, for the subsets left after taking out the rules that hit
+PREFILTER = -2  # the progress reported, and the key in `timings`, for the combined passes
+
+
+def _is_native(compiled) -> bool:
+    # pyre2 quietly hands patterns RE2 can't do (lookarounds, backreferences) to the fallback module
+    return isinstance(compiled, re2.Pattern)
+
+
+def _without_lookarounds(pattern: str) -> Optional[str]:
+    """The pattern with its lookarounds taken out, which matches everything the pattern does (and then some), or None
+    if there weren't any. Good enough to rule out a pattern RE2 can't run, but a hit still needs the real thing."""
+    out = []
+    position = 0
+    found = False
+    while position < len(pattern):
+        if pattern.startswith(("(?=", "(?!", "(?<=", "(?<!"), position):
+            found = True
+            position = _group_end(pattern, position)
+            continue
+        end = _token_end(pattern, position)
+        out.append(pattern[position:end])
+        position = end
+    return "".join(out) if found else None
+
+
+def _token_end(pattern: str, position: int) -> int:
+    """Where the escape, character class or single character starting at `position` ends."""
+    if pattern[position] == "\\":
+        return position + 2
+    if pattern[position] == "[":
+        position += 1
+        if position < len(pattern) and pattern[position] == "^":
+            position += 1
+        if position < len(pattern) and pattern[position] == "]":
+            position += 1  # a ] straight after the [ is literal
+        while position < len(pattern) and pattern[position] != "]":
+            position += 2 if pattern[position] == "\\" else 1
+        return position + 1
+    return position + 1
+
+
+def _group_end(pattern: str, position: int) -> int:
+    """Where the group opened at `position` is closed."""
+    depth = 0
+    while position < len(pattern):
+        if pattern[position] == "(":
+            depth += 1
+        elif pattern[position] == ")":
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position = _token_end(pattern, position)
+    return position
+
+
+class RuleSet:
+    """A group of patterns that are searched for together, in as few passes over the text as possible.
+
+    The patterns are joined into alternations of named groups, `PREFILTER_CHUNK` at a time, for RE2 to search.
+    A search of an alternation finds a match of one of its rules if any of them match anywhere, and the group that
+    took part says which. That rule is taken out and the rest searched again, until nothing matches, so each chunk
+    costs one pass per rule that hits plus one. Patterns with lookarounds go in with them taken out, which can only
+    make them match more. Patterns RE2 can't run even then (backreferences etc.) are always searched individually.
+    Only the patterns that got through get a full search, which also extracts their groups."""
+
+    def __init__(self, patterns: list[str], flags: int = 0):
+        self.patterns = patterns
+        self.flags = flags
+        # identifies the rules, so workers that already compiled them don't need them sent again
+        self.key = hash((tuple(patterns), flags))
+        self._compiled: Optional[list[Optional[re2.Pattern]]] = None  # compiled on first use
+        self._individual: list[int] = []  # indices of rules that can't be combined
+        self._combinable: dict[int, str] = {}  # rule index -> what it's combined as
+        self._chunks: list[tuple[int, ...]] = []
+        self._combined: dict[tuple[int, ...], Optional[re2.Pattern]] = {}
+
+    def _compile(self):
+        self._compiled = []
+        for index, pattern in enumerate(self.patterns):
+            try:
+                compiled = re2.compile(pattern, self.flags)
+            except (re2.error, re2.RegexError, regex_fallback.error) as e:
+                logger.error(f"Skipping invalid pattern ({pattern}): {e}")
+                self._compiled.append(None)
+                continue
+
+            self._compiled.append(compiled)
+            if _is_native(compiled):
+                self._combinable[index] = pattern
+            elif (relaxed := _without_lookarounds(pattern)) is not None and self._compiles_natively(relaxed):
+                self._combinable[index] = relaxed
+            else:
+                self._individual.append(index)
+
+        native = list(self._combinable)
+
+        self._chunks = [tuple(native[i : i + PREFILTER_CHUNK]) for i in range(0, len(native), PREFILTER_CHUNK)]
+        for chunk in self._chunks:
+            self._combine(chunk)
+
+    def _compiles_natively(self, pattern: str) -> bool:
+        try:
+            return _is_native(re2.compile(pattern, self.flags))
+        except (re2.error, re2.RegexError, regex_fallback.error):
+            return False
+
+    def _combine(self, indices: tuple[int, ...]) -> Optional[re2.Pattern]:
+        """The alternation of these rules, or None if RE2 won't take it (e.g. two rules use the same group name)."""
+        if indices in self._combined:
+            return self._combined[indices]
+
+        pattern = "|".join(f"(?P<fred_rule_{index}>{self._combinable[index]})" for index in indices)
+        try:
+            combined = re2.compile(pattern, self.flags)
+            if not _is_native(combined):
+                combined = None
+        except (re2.error, re2.RegexError, regex_fallback.error):
+            combined = None
+        if combined is None and len(indices) > 1:
+            logger.warning(f"Unable to combine {len(indices)} rules, searching them individually")
+
+        if len(self._combined) >= len(self._chunks) + PREFILTER_CACHE:
+            # the whole chunks come first and are always used, so only the subsets get evicted
+            del self._combined[next(key for key in self._combined if key not in self._chunks)]
+        self._combined[indices] = combined
+        return combined
+
+    def __len__(self) -> int:
+        return len(self.patterns)
 
-def pattern_uses_lookaround(pattern: str) -> bool:
-    return bool(regex_fallback.search(r"\(\?=|\(\?!|\(\?<=|\(\?<!", pattern))
+    def _prefilter(self, text: str, chunk: tuple[int, ...]) -> list[int]:
+        """The rules in `chunk` that match somewhere in `text`, or that have to be searched to find out."""
+        hits = []
+        remaining = chunk
+        while remaining:
+            if (combined := self._combine(remaining)) is None:
+                return hits + list(remaining)
+            report_progress(PREFILTER)
+            if (match := combined.search(text)) is None:
+                break
+            matched = next(index for index in remaining if match.group(f"fred_rule_{index}") is not None)
+            hits.append(matched)
+            remaining = tuple(index for index in remaining if index != matched)
+        return hits
 
+    def _candidates(self, text: str, timings: Optional[dict[int, float]]) -> list[int]:
+        start = time.perf_counter()
+        hits = [index for chunk in self._chunks for index in self._prefilter(text, chunk)]
+        if timings is not None:
+            timings[PREFILTER] = time.perf_counter() - start
+        return sorted(hits + self._individual)
 
-async def safe_search(pattern: str, text: str, flags=0):
+    def search_all(self, text: str, timings: Optional[dict[int, float]] = None) -> list[tuple[int, re2.Match]]:
+        """Returns (rule index, match) for every rule that matches, in rule order.
+        If `timings` is given, the time spent searching each rule individually is recorded in it, and the time spent
+        on the combined passes under `PREFILTER`."""
+        if self._compiled is None:
+            self._compile()
+        results = []
+        for index in self._candidates(text, timings):
+            report_progress(index)
+            start = time.perf_counter()
+            match = self._compiled[index].search(text)
+            if timings is not None:
+                timings[index] = time.perf_counter() - start
+            if match:
+                results.append((index, match))
+        return results
+
+
+class MatchResult:
+    """The parts of a match we use, brought back from a worker process (match objects can't be pickled)."""
+
+    def __init__(self, groups: tuple[Optional[str], ...]):
+        self._groups = groups  # group 0 first
+
+    def group(self, group: int = 0) -> Optional[str]:
+        return self._groups[group]
+
+    def groups(self) -> tuple[Optional[str], ...]:
+        return self._groups[1:]
+
+
+def _match_groups(match) -> tuple[Optional[str], ...]:
+    return match.group(0), *match.groups()
+
+
+# These run inside the worker processes. Each worker keeps the last few rule sets it was given.
+_WORKER_RULE_SETS = 4
+_worker_rules: dict[int, RuleSet] = {}
+
+
+def _load_rules(key: int, patterns: list[str], flags: int):
+    rules = RuleSet(patterns, flags)
+    rules.search_all("")  # compiles everything now rather than during the first real search
+    _worker_rules[key] = rules
+    while len(_worker_rules) > _WORKER_RULE_SETS:
+        del _worker_rules[next(iter(_worker_rules))]
+
+
+def _search_rules(key: int, text: str) -> tuple[list[tuple[int, tuple[Optional[str], ...]]], dict[int, float]]:
+    timings = {}
+    hits = [(index, _match_groups(match)) for index, match in _worker_rules[key].search_all(text, timings)]
+    return hits, timings
+
+
+def _search(pattern: str, text: str, flags: int) -> Optional[tuple[Optional[str], ...]]:
+    if match := re2.search(pattern, text, flags=flags):
+        return _match_groups(match)
+    return None
+
+
+class RuleTimeoutError(TimeoutError):
+    def __init__(self, message: str, rule_index: Optional[int]):
+        super().__init__(message)
+        self.rule_index = rule_index  # the rule that went over its own limit, None if it was a combined pass
+
+
+regex_pool = KillableProcessPool("regex", pool_size(getenv("FRED_REGEX_WORKERS"), 2))
+
+
+async def safe_search(pattern: str, text: str, flags=0) -> Optional[MatchResult]:
     try:
-        return await asyncio.wait_for(asyncio.to_thread(re2.search, pattern, text, flags=flags), REGEX_LIMIT)
-    except asyncio.TimeoutError:
+        groups = await regex_pool.run(_search, pattern, text, flags, timeout=REGEX_LIMIT)
+    except TimeoutError:
         raise TimeoutError(
             f"A regex timed out after {REGEX_LIMIT} seconds! \n"
             f"pattern: ({pattern}) \n"
             f"flags: {flags} \n"
             f"on text of length {len(text)}"
         )
+    return MatchResult(groups) if groups is not None else None
+
+
+async def safe_search_all(
+    rules: RuleSet, text: str, timings: Optional[dict[int, float]] = None
+) -> list[tuple[int, MatchResult]]:
+    """Like `RuleSet.search_all`, in a worker. Raises `RuleTimeoutError` if the rules take too long."""
+    async with regex_pool.worker() as worker:
+        loaded: list[int] = worker.meta.setdefault("rules", [])
+        if rules.key not in loaded:
+            await worker.call(_load_rules, rules.key, rules.patterns, rules.flags, timeout=RULE_LOAD_LIMIT)
+            loaded.append(rules.key)
+            del loaded[:-_WORKER_RULE_SETS]  # mirrors what the worker keeps
+        try:
+            # every rule and combined pass gets REGEX_LIMIT of its own, the overall timeout is only a backstop
+            hits, rule_timings = await worker.call(
+                _search_rules, rules.key, text, timeout=REGEX_LIMIT * (len(rules) + 1), stall_timeout=REGEX_LIMIT
+            )
+        except WorkerStalled:
+            rule_index = worker.progress if worker.progress >= 0 else None
+            raise RuleTimeoutError(
+                f"A rule timed out after {REGEX_LIMIT} seconds! \n"
+                f"rules: {len(rules)} \n"
+                f"flags: {rules.flags} \n"
+                f"stuck on: {rules.patterns[rule_index] if rule_index is not None else 'a combined pass'} \n"
+                f"on text of length {len(text)}",
+                rule_index,
+            )
+        except TimeoutError:
+            raise RuleTimeoutError(
+                f"A rule set of {len(rules)} rules timed out after {REGEX_LIMIT * (len(rules) + 1)} seconds "
+                f"on text of length {len(text)}",
+                None,
+            )
+    if timings is not None:
+        timings.update(rule_timings)
+    return [(index, MatchResult(groups)) for index, groups in hits]
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import bisect
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, TypedDict
+
+from attr import dataclass
+from semver import Version
+
+if TYPE_CHECKING:
+    from ..config import SMRModDict
+
+
+class SMLVersion(TypedDict):
+    version: str
+    satisfactory_version: int
+
+
+class SMLVersions:
+    """The SML releases as SMR lists them (newest first), arranged to find the newest one a game CL can run quickly."""
+
+    def __init__(self, versions: list[SMLVersion]):
+        self.versions = versions
+        by_game_version = sorted(enumerate(versions), key=lambda item: item[1]["satisfactory_version"])
+        self._game_versions = [version["satisfactory_version"] for _, version in by_game_version]
+        # for each prefix of the sorted list, the release SMR lists first, i.e. the newest
+        self._newest: list[SMLVersion] = []
+        best = None
+        for position, version in by_game_version:
+            if best is None or position < best[0]:
+                best = (position, version)
+            self._newest.append(best[1])
+
+    @property
+    def latest(self) -> Optional[SMLVersion]:
+        return self.versions[0] if self.versions else None
+
+    def latest_compatible(self, game_version: int) -> Optional[SMLVersion]:
+        """The newest release that supports `game_version`, or None if it's older than every release."""
+        if (index := bisect.bisect_right(self._game_versions, game_version)) == 0:
+            return None
+        return self._newest[index - 1]
+
+    def __len__(self) -> int:
+        return len(self.versions)
+
+
+@lru_cache(maxsize=4096)
+def parse_version(version: str) -> Version:
+    # the same handful of versions come up in modpack after modpack
+    return Version.parse(version)
+
+
+class CompatibilityInfo(TypedDict):
+    state: str
+    note: str
+
+
+@dataclass(frozen=True)
+class ModInfo:
+    """What we need to know about a mod on SMR to check someone's copy of it."""
+
+    name: str
+    mod_reference: str
+    latest_version: Version
+    compatibility: Optional[CompatibilityInfo]  # None if SMR doesn't know
+
+    @classmethod
+    def from_query(cls, mod: dict) -> ModInfo:
+        compatibility = mod["compatibility"]
+        return cls(
+            name=mod["name"],
+            mod_reference=mod["mod_reference"],
+            latest_version=parse_version(mod["versions"][0]["version"]),
+            # only the branch we asked about is in there
+            compatibility=compatibility and (compatibility.get("EA") or compatibility.get("EXP")),
+        )
+
+    @classmethod
+    def from_mirror(cls, mod: SMRModDict, branch: str) -> Optional[ModInfo]:
+        if mod["latest_version"] is None:
+            return None  # nothing released, so nothing to compare against
+        return cls(
+            name=mod["name"],
+            mod_reference=mod["mod_reference"],
+            latest_version=parse_version(mod["latest_version"]),
+            compatibility=(mod["compatibility"] or {}).get(branch),
+        )
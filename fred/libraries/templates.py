@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import re as regex_fallback
+from types import EllipsisType
+from typing import Callable
+
+ALL_ARGUMENTS = ...  # stands for `{...}` in a command's template
+
+# literal text, the number of a group or argument to substitute, or ALL_ARGUMENTS
+type TemplateSegment = str | int | EllipsisType
+
+_NUMBERED = regex_fallback.compile(r"{(\d+)}")
+_NUMBERED_OR_ALL = regex_fallback.compile(r"{(\d+)}|{\.\.\.}")
+
+
+def parse_template(text: str, all_arguments: bool = False) -> list[TemplateSegment]:
+    """Splits a response into literal text and `{n}` placeholders (and `{...}` with `all_arguments`), so it's only
+    parsed once rather than every time it's used."""
+    segments: list[TemplateSegment] = []
+    position = 0
+    for placeholder in (_NUMBERED_OR_ALL if all_arguments else _NUMBERED).finditer(text):
+        if placeholder.start() > position:
+            segments.append(text[position : placeholder.start()])
+        segments.append(ALL_ARGUMENTS if placeholder.group(1) is None else int(placeholder.group(1)))
+        position = placeholder.end()
+    if position < len(text):
+        segments.append(text[position:])
+    return segments
+
+
+def render_template(template: list[TemplateSegment], fill: Callable[[int | EllipsisType], str]) -> str:
+    """Puts the template back together, with `fill` giving what each placeholder stands for."""
+    return "".join(segment if isinstance(segment, str) else fill(segment) for segment in template)
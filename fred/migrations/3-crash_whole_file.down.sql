@@ -0,0 +1,2 @@
+ALTER TABLE crashes
+DROP COLUMN IF EXISTS whole_file;
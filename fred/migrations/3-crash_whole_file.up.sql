@@ -0,0 +1,2 @@
+ALTER TABLE crashes
+ADD COLUMN IF NOT EXISTS whole_file BOOLEAN NOT NULL DEFAULT false;
@@ -0,0 +1 @@
+DROP TABLE IF EXISTS smr_mods;
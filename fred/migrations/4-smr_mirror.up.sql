@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS smr_mods (
+    id SERIAL PRIMARY KEY,
+    mod_reference TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    latest_version TEXT,
+    compatibility TEXT,
+    updated_at TEXT
+);
@@ -0,0 +1 @@
+DROP INDEX IF EXISTS users_user_id_key;
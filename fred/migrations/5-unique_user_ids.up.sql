@@ -0,0 +1,8 @@
+-- levelling upserts users by user_id, which needs it to be unique.
+-- keep the row with the most xp for anyone who ended up with several
+DELETE FROM users duplicate
+USING users kept
+WHERE duplicate.user_id = kept.user_id
+  AND (duplicate.xp_count < kept.xp_count OR (duplicate.xp_count = kept.xp_count AND duplicate.id > kept.id));
+
+CREATE UNIQUE INDEX IF NOT EXISTS users_user_id_key ON users (user_id);
@@ -0,0 +1,6 @@
+DROP INDEX IF EXISTS role_perms_perm_lvl_idx;
+DROP INDEX IF EXISTS rank_roles_rank_idx;
+DROP INDEX IF EXISTS crashes_name_idx;
+DROP INDEX IF EXISTS commands_name_idx;
+DROP INDEX IF EXISTS media_only_channels_channel_id_key;
+DROP INDEX IF EXISTS miscellaneous_key_key;
@@ -0,0 +1,21 @@
+-- settings are upserted by key, which needs it to be unique. the newest row is the one that was last written
+DELETE FROM miscellaneous duplicate
+USING miscellaneous kept
+WHERE duplicate.key = kept.key AND duplicate.id < kept.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS miscellaneous_key_key ON miscellaneous (key);
+
+-- a channel listed twice is still just media only
+DELETE FROM media_only_channels duplicate
+USING media_only_channels kept
+WHERE duplicate.channel_id = kept.channel_id AND duplicate.id > kept.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS media_only_channels_channel_id_key ON media_only_channels (channel_id);
+
+-- commands and crashes are looked up by name on every message, but may have duplicates we shouldn't silently drop
+CREATE INDEX IF NOT EXISTS commands_name_idx ON commands (name);
+CREATE INDEX IF NOT EXISTS crashes_name_idx ON crashes (name);
+
+-- rank and permission checks look for the highest row at or below/above a level
+CREATE INDEX IF NOT EXISTS rank_roles_rank_idx ON rank_roles (rank);
+CREATE INDEX IF NOT EXISTS role_perms_perm_lvl_idx ON role_perms (perm_lvl);